@@ -0,0 +1,342 @@
+"""Benchmark do pipeline do Training Report com planilhas sintéticas.
+
+Gera Team, Trainings, Control, Training Type Listing e Unisea no layout que o pipeline lê, em
+tamanhos configuráveis (linhas do Control), e mede tempo e pico de memória de cada etapa:
+leitura (xlsx -> Parquet), merge, match, categorização, revisões e gravação do relatório.
+Os resultados vão para um JSON, que pode ser comparado com uma execução anterior:
+
+    python benchmark.py --sizes 1000 10000 100000
+    python benchmark.py --sizes 1000000 --typo-rates 0 0.2 --low-memory
+    python benchmark.py --sizes 10000 --baseline benchmark_results/bench_20260101_120000.json
+    python benchmark.py --sizes 10000 100000 --categorize
+
+Cada cenário roda num processo novo, para que o pico de memória de um não contamine o outro.
+As planilhas geradas ficam em --data-dir e são reaproveitadas entre execuções.
+"""
+import argparse
+import json
+import os
+import multiprocessing
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from training_engine import (
+    INPUT_FILE_NAMES, MAX_WORKERS, PIPELINE_STAGES, StageProfiler, build_categoria_map, ensure_ingested,
+    parquet_path_for, run_pipeline, stream_parquet_path_for, write_report_artifacts, write_xlsx_streaming,
+)
+
+# ========================
+# Geradores de Planilhas Sintéticas
+# ========================
+BENCH_STAGES = ["read"] + list(PIPELINE_STAGES) + ["write"]
+DATASET_MANIFEST = "dataset.json"
+PROCEDURES_PER_POSITION = 30
+CONTROL_ROWS_PER_MEMBER = 40  # define o tamanho da equipe: o restante do Control são ex-funcionários e outras unidades
+
+FIRST_NAMES = ["JOÃO", "MARIA", "JOSÉ", "ANA", "PEDRO", "LUCAS", "JOHN", "PAUL", "MARK", "ÉRICA", "CARLOS", "RITA",
+               "FERNANDA", "ANDRÉ", "OLUWASEUN", "MAGNUS", "RAFAEL", "PRISCILA", "TIAGO", "LEE"]
+LAST_NAMES = ["SILVA", "SOUZA", "OLIVEIRA", "SMITH", "BROWN", "PEREIRA", "COSTA", "LIMA", "GOMES", "ARAÚJO",
+              "HANSEN", "SANTOS", "NUNES", "CRUZ", "REYES", "MARTINS"]
+LETRAS = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+
+def _nomes(prefixo, quantidade, rng):
+    primeiros = rng.choice(FIRST_NAMES, quantidade)
+    ultimos = rng.choice(LAST_NAMES, quantidade)
+    return [f"{p} {u} {prefixo}{i:06d}" for i, (p, u) in enumerate(zip(primeiros, ultimos))]
+
+def _com_erros(nomes, typo_rate, rng):
+    """Troca uma letra dos nomes sorteados (typo_rate) e deixa parte em minúsculas, como no Control digitado."""
+    nomes = np.array(nomes, dtype=object)
+    sorteio = rng.random(len(nomes))
+    for i in np.flatnonzero(sorteio < typo_rate):
+        nome = nomes[i]
+        j = int(rng.integers(len(nome)))
+        nomes[i] = nome[:j] + rng.choice(LETRAS) + nome[j + 1:]
+    minusculas = (sorteio >= typo_rate) & (sorteio < typo_rate + 0.05)
+    nomes[minusculas] = [n.lower() for n in nomes[minusculas]]
+    return nomes
+
+def generate_dataset(control_rows, typo_rate=0.1, seed=0):
+    """DataFrames sintéticos {nome do arquivo: df} com cerca de control_rows linhas no Control."""
+    rng = np.random.default_rng(seed)
+    n_team = max(10, control_rows // CONTROL_ROWS_PER_MEMBER)
+    n_cargos = int(np.clip(n_team // 25, 4, 60))
+
+    cargo_membro = rng.integers(n_cargos, size=n_team)
+    nomes_membros = _nomes("", n_team, rng)
+    team = pd.DataFrame({
+        "Position in Matrix": [f"Operator {c}\nOperador {c}" for c in cargo_membro],
+        "Unisea E-learning User": nomes_membros,
+        "Nationality": rng.choice(["BR", "BR", "UK", "NO", "PH", None], n_team),
+        "Crew": rng.choice(["A", "B"], n_team),
+    })
+
+    cargo_proc = np.repeat(np.arange(n_cargos), PROCEDURES_PER_POSITION)
+    seq_proc = np.tile(np.arange(PROCEDURES_PER_POSITION), n_cargos)
+    codigo_en = np.array([f"EN-{c:02d}-{k:03d}" for c, k in zip(cargo_proc, seq_proc)], dtype=object)
+    codigo_pt = np.array([f"PT-{c:02d}-{k:03d}" for c, k in zip(cargo_proc, seq_proc)], dtype=object)
+    codigo_pt[rng.random(len(codigo_pt)) < 0.1] = None
+    nome_proc = np.array([f"PROCEDURE {c}-{k}" + (" VCP" if k % 5 == 0 else "") for c, k in zip(cargo_proc, seq_proc)])
+    revisao = rng.integers(0, 6, len(cargo_proc))
+    trainings = pd.DataFrame({
+        "Position EN": [f"Operator {c}" for c in cargo_proc],
+        "Position PT": [f"Operador {c}" for c in cargo_proc],
+        "Procedure": nome_proc,
+        "Code EN": codigo_en,
+        "Code PT": codigo_pt,
+        "Requirement": rng.choice(["Mandatory", "Recommended"], len(cargo_proc), p=[0.8, 0.2]),
+    })
+
+    # Linhas da equipe: cada membro tem ~80% dos procedimentos do cargo no Control, alguns repetidos
+    membro = np.repeat(np.arange(n_team), PROCEDURES_PER_POSITION)
+    proc = cargo_membro[membro] * PROCEDURES_PER_POSITION + np.tile(np.arange(PROCEDURES_PER_POSITION), n_team)
+    manter = rng.random(len(membro)) < 0.8
+    membro, proc = membro[manter], proc[manter]
+    repetir = rng.random(len(membro)) < 0.1
+    membro, proc = np.concatenate([membro, membro[repetir]]), np.concatenate([proc, proc[repetir]])
+    brasileiro = (team["Nationality"].to_numpy() == "BR")[membro]
+    codigo = np.where(brasileiro & pd.notna(codigo_pt[proc]), codigo_pt[proc], codigo_en[proc])
+    if len(membro) > control_rows:
+        escolhidos = np.sort(rng.choice(len(membro), control_rows, replace=False))
+        membro, proc, codigo = membro[escolhidos], proc[escolhidos], codigo[escolhidos]
+    nomes_control = _com_erros(np.array(nomes_membros, dtype=object)[membro], typo_rate, rng)
+
+    # Demais linhas: ex-funcionários e outras unidades, com códigos existentes ou desconhecidos
+    n_extra = max(0, control_rows - len(membro))
+    proc_extra = rng.integers(len(cargo_proc), size=n_extra)
+    codigo_extra = np.where(rng.random(n_extra) < 0.9, codigo_en[proc_extra], "ZZ-000")
+    nomes_control = np.concatenate([nomes_control, np.array(_nomes("X", n_extra, rng), dtype=object)])
+    proc = np.concatenate([proc, proc_extra])
+    codigo = np.concatenate([codigo, codigo_extra])
+
+    n_control = len(proc)
+    rev_control = np.where(rng.random(n_control) < 0.85, revisao[proc], rng.integers(0, 6, n_control))
+    datas = pd.Timestamp("2023-01-01") + pd.to_timedelta(rng.integers(0, 900, n_control), unit="D")
+    control = pd.DataFrame({
+        "Name": nomes_control,
+        "Company": "YINSON",
+        "Unit": "FPSO",
+        "Department": rng.choice(["OPS", "MAINT", "HSE"], n_control),
+        "Code": codigo,
+        "Procedure": [f"{nome_proc[p]} REV. {r:02d}" for p, r in zip(proc, rev_control)],
+        "Instructor": "-",
+        "Hours": rng.integers(1, 9, n_control),
+        "Status": rng.choice(["Completed", "completed", "In progress"], n_control, p=[0.8, 0.05, 0.15]),
+        "Date Completed": pd.Series(datas).where(rng.random(n_control) < 0.9),
+    })
+
+    training_type = pd.DataFrame({
+        "Code EN": codigo_en,
+        "Code PT": codigo_pt,
+        "Category": rng.choice(["HSE", "OPERATION", "MAINTENANCE", "QUALITY"], len(codigo_en)),
+    })
+    unisea = pd.DataFrame({f"Column {i}": "-" for i in range(1, 9)}, index=range(len(codigo_en)))
+    unisea.insert(0, "Code", codigo_en)
+    unisea["Revision"] = [f"REV {r}" if rng.random() < 0.9 else None for r in revisao]
+
+    return dict(zip(INPUT_FILE_NAMES, [team, trainings, control, training_type, unisea]))
+
+def write_dataset(folder, control_rows, typo_rate=0.1, seed=0):
+    """Grava as planilhas em folder, reaproveitando as de uma execução anterior com os mesmos parâmetros."""
+    parametros = {"control_rows": control_rows, "typo_rate": typo_rate, "seed": seed}
+    manifesto = os.path.join(folder, DATASET_MANIFEST)
+    if os.path.exists(manifesto):
+        with open(manifesto, encoding="utf-8") as f:
+            existente = json.load(f)
+        if existente["params"] == parametros:
+            return existente
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    linhas = {}
+    for nome, df in generate_dataset(control_rows, typo_rate, seed).items():
+        write_xlsx_streaming(df, os.path.join(folder, nome))
+        linhas[nome] = len(df)
+    info = {"params": parametros, "rows": linhas}
+    with open(manifesto, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    return info
+
+# ========================
+# Medição
+# ========================
+def run_scenario(folder, workers=MAX_WORKERS, low_memory=False, fuzzy_threshold=80):
+    """Roda o pipeline completo sobre as planilhas de folder e mede cada etapa (sem cache de etapas)."""
+    paths = [os.path.join(folder, nome) for nome in INPUT_FILE_NAMES]
+    for path in paths:
+        for parquet_path in (parquet_path_for(path), stream_parquet_path_for(path)):
+            if os.path.exists(parquet_path):
+                os.remove(parquet_path)  # a leitura também é medida
+    nomes_etapas = {rotulo: nome for nome, rotulo in PIPELINE_STAGES.items()}
+    saida = tempfile.mkdtemp(prefix="report_", dir=folder)
+    profiler = StageProfiler()
+    profiler.start()
+    try:
+        with profiler.stage("read"):
+            for path in paths:
+                ensure_ingested(path, streaming=low_memory and path == paths[2])
+        df_final, _ = run_pipeline(*paths, fuzzy_threshold=fuzzy_threshold, workers=workers, low_memory=low_memory,
+                                   profiler=profiler)
+        with profiler.stage("write"):
+            write_report_artifacts(df_final, saida)
+    finally:
+        profiler.stop()
+        shutil.rmtree(saida, ignore_errors=True)
+
+    pico_processo = profiler.peak_rss_mb
+    if resource is not None:
+        pico_processo = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                              * (1 if platform.system() == "Darwin" else 1024) / 1024 / 1024, 1)
+    return {
+        "stages": {nomes_etapas.get(e["name"], e["name"]): {"seconds": e["seconds"], "peak_rss_mb": e["peak_rss_mb"]}
+                   for e in profiler.stages},
+        "total_seconds": profiler.total_seconds,
+        "peak_rss_mb": pico_processo,
+        "final_rows": len(df_final),
+        "exact_match_rate": round(float((df_final["match_score"] == 100).mean()), 4) if len(df_final) else None,
+        "status_counts": {str(k): int(v) for k, v in df_final["status_final"].value_counts().items()},
+    }
+
+def _categoria_por_linha(df_type, procedimentos):
+    """Categorização original: filtra a listagem inteira para cada linha do relatório."""
+    def get_categoria(procedimento):
+        match = df_type[(df_type['procedimento_num_en_type'].astype(str).str.strip() == procedimento) |
+                        (df_type['procedimento_num_pt_type'].astype(str).str.strip() == procedimento)]
+        if not match.empty:
+            return match.iloc[0]['categoria']
+        return None
+    return procedimentos.apply(get_categoria)
+
+def run_categorize_comparison(control_rows, seed=0):
+    """Compara a categorização linha a linha com o mapa de build_categoria_map.
+
+    Os códigos categorizados são os do Control sintético (códigos EN, PT e desconhecidos), uma linha
+    por registro, como os códigos atribuídos do relatório.
+    """
+    dados = generate_dataset(control_rows, seed=seed)
+    df_type = dados["Training_Type_Listing.xlsx"].copy()
+    df_type.columns = ['procedimento_num_en_type', 'procedimento_num_pt_type', 'categoria']
+    procedimentos = dados["Control.xlsx"]["Code"].astype(str).str.strip()
+
+    inicio = time.perf_counter()
+    por_linha = _categoria_por_linha(df_type, procedimentos)
+    segundos_por_linha = time.perf_counter() - inicio
+    inicio = time.perf_counter()
+    por_mapa = procedimentos.map(build_categoria_map(df_type))
+    segundos_mapa = time.perf_counter() - inicio
+
+    iguais = por_linha.astype(object).where(por_linha.notna(), None).tolist() == \
+        por_mapa.astype(object).where(por_mapa.notna(), None).tolist()
+    return {"control_rows": control_rows, "rows": len(procedimentos), "listing_rows": len(df_type),
+            "per_row_seconds": round(segundos_por_linha, 4), "map_seconds": round(segundos_mapa, 4),
+            "identical": iguais}
+
+# ========================
+# Execução e Comparação
+# ========================
+def _versao_codigo():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare_results(atual, baseline):
+    """Linhas de texto com a variação de tempo por etapa em relação a uma execução anterior."""
+    anteriores = {(r["control_rows"], r["typo_rate"]): r for r in baseline["results"]}
+    linhas = []
+    for r in atual["results"]:
+        antes = anteriores.get((r["control_rows"], r["typo_rate"]))
+        if antes is None:
+            continue
+        linhas.append(f"{r['control_rows']} rows, typo rate {r['typo_rate']}:")
+        for etapa in BENCH_STAGES + ["total"]:
+            novo = r["total_seconds"] if etapa == "total" else r["stages"].get(etapa, {}).get("seconds")
+            velho = antes["total_seconds"] if etapa == "total" else antes["stages"].get(etapa, {}).get("seconds")
+            if novo is None or not velho:
+                continue
+            linhas.append(f"  {etapa:<11} {velho:9.3f}s -> {novo:9.3f}s  ({(novo / velho - 1) * 100:+.1f}%)")
+    return linhas
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Training Report pipeline on synthetic workbooks.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Control.xlsx rows of each scenario (e.g. 1000 to 1000000)")
+    parser.add_argument("--typo-rates", type=float, nargs="+", default=[0.1],
+                        help="share of Control names with a typo (exercises the fuzzy match)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="control matching threads")
+    parser.add_argument("--low-memory", action="store_true", help="stream Control.xlsx in batches")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per scenario; the fastest is kept")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "training_benchmark"),
+                        help="where the generated workbooks are kept between runs")
+    parser.add_argument("--output", default=None,
+                        help="results JSON (default: benchmark_results/bench_<timestamp>.json)")
+    parser.add_argument("--baseline", default=None, help="previous results JSON to compare against")
+    parser.add_argument("--categorize", action="store_true",
+                        help="only compare the per-row category lookup with the category map (slow on large sizes)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    resultados = {
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "commit": _versao_codigo(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "settings": {"workers": args.workers, "low_memory": args.low_memory, "repeat": args.repeat},
+        "results": [],
+    }
+    if args.categorize:
+        resultados["categorize"] = []
+        for tamanho in args.sizes:
+            print(f"Categorizing {tamanho} control rows...", flush=True)
+            r = run_categorize_comparison(tamanho, args.seed)
+            resultados["categorize"].append(r)
+            print(f"  {r['rows']} rows, {r['listing_rows']} listing rows | per row {r['per_row_seconds']:.3f}s  "
+                  f"map {r['map_seconds']:.3f}s  identical {r['identical']}", flush=True)
+    else:
+        contexto = multiprocessing.get_context("spawn")
+        for typo_rate in args.typo_rates:
+            for tamanho in args.sizes:
+                folder = os.path.join(args.data_dir, f"control_{tamanho}_typo_{typo_rate}_seed_{args.seed}")
+                print(f"Generating {tamanho} control rows (typo rate {typo_rate})...", flush=True)
+                dataset = write_dataset(folder, tamanho, typo_rate, args.seed)
+                melhor = None
+                for _ in range(args.repeat):
+                    with ProcessPoolExecutor(max_workers=1, mp_context=contexto) as executor:
+                        medicao = executor.submit(run_scenario, folder, args.workers, args.low_memory).result()
+                    if melhor is None or medicao["total_seconds"] < melhor["total_seconds"]:
+                        melhor = medicao
+                resultados["results"].append({"control_rows": tamanho, "typo_rate": typo_rate, "seed": args.seed,
+                                              "input_rows": dataset["rows"], **melhor})
+                etapas = "  ".join(f"{nome} {m['seconds']:.2f}s" for nome, m in melhor["stages"].items())
+                print(f"  total {melhor['total_seconds']:.2f}s, peak {melhor['peak_rss_mb']} MB | {etapas}", flush=True)
+
+    output = args.output or os.path.join("benchmark_results", f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(resultados, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            for linha in compare_results(resultados, json.load(f)):
+                print(linha)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""Caches gravados por uma versão anterior do pipeline ou do formato de ingestão não são reaproveitados."""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import training_engine
+from training_engine import (
+    PARQUET_FORMAT_VERSION, ensure_ingested, parquet_format_version, read_parquet, stage_key, stream_parquet_path_for,
+)
+
+def test_stage_key_muda_com_a_versao_do_pipeline(monkeypatch):
+    chave = stage_key("match", "abc", 80, False)
+    assert stage_key("match", "abc", 80, False) == chave
+    monkeypatch.setattr(training_engine, "PIPELINE_CACHE_VERSION", training_engine.PIPELINE_CACHE_VERSION + 1)
+    assert stage_key("match", "abc", 80, False) != chave
+
+def test_parquet_de_formato_antigo_e_gerado_de_novo(tmp_path):
+    xlsx = str(tmp_path / "Control.xlsx")
+    pd.DataFrame({"Date Completed": [pd.Timestamp("2024-05-15"), "N/A", "15/03/2024"]}).to_excel(xlsx, index=False)
+    for streaming in (False, True):
+        parquet_path = ensure_ingested(xlsx, streaming)
+        assert parquet_format_version(parquet_path) == PARQUET_FORMAT_VERSION
+
+        # Parquet da versão anterior: mesma coluna gravada como texto, sem a versão do formato, mais novo que o xlsx
+        pq.write_table(pq.read_table(parquet_path).drop_columns(["Date Completed"]).append_column(
+            "Date Completed", pa.array(["2024-05-15 00:00:00", "N/A", "15/03/2024"])).replace_schema_metadata(None),
+            parquet_path)
+        os.utime(parquet_path, (os.path.getmtime(xlsx) + 10,) * 2)
+        assert parquet_format_version(parquet_path) is None
+
+        assert ensure_ingested(xlsx, streaming) == parquet_path
+        assert parquet_format_version(parquet_path) == PARQUET_FORMAT_VERSION
+        valores = read_parquet(parquet_path)["Date Completed"].tolist()
+        assert valores[0] == pd.Timestamp("2024-05-15") and pd.isna(valores[1]) and valores[2] == "15/03/2024"
+    assert os.path.exists(stream_parquet_path_for(xlsx))
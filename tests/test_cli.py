@@ -0,0 +1,45 @@
+"""Execução em lote (main) usada pelo cron: job de arquivamento do histórico."""
+import json
+import zlib
+from datetime import datetime, timedelta
+
+import pytest
+
+import training_engine
+from training_engine import get_db, main
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(training_engine, "DB_PATH", str(tmp_path / "report_history.db"))
+    monkeypatch.setattr(training_engine, "_db_pool", None)
+    return tmp_path
+
+def _registrar(dias_atras, arquivo):
+    quando = (datetime.now() - timedelta(days=dias_atras)).strftime("%Y-%m-%d %H:%M:%S")
+    with get_db().connection() as conn:
+        conn.execute("INSERT INTO report_history (timestamp, report_type, file_name, filter_options, user) "
+                     "VALUES (?, 'Final', ?, '{}', 'batch')", (quando, arquivo))
+
+def test_archive_history_sem_sessoes(banco, capsys):
+    _registrar(400, "antigo.xlsx")
+    _registrar(45, "mes_passado.xlsx")
+    _registrar(1, "recente.xlsx")
+
+    assert main(["--root", str(banco), "--archive-history", "30"]) == 0
+    assert "2 history entries older than 30 day(s) archived" in capsys.readouterr().out
+
+    with get_db().connection() as conn:
+        restantes = [r[0] for r in conn.execute("SELECT file_name FROM report_history")]
+        arquivados = [linha[3] for (payload,) in conn.execute("SELECT payload FROM report_history_archive")
+                      for linha in json.loads(zlib.decompress(payload))]
+    assert restantes == ["recente.xlsx"]
+    assert sorted(arquivados) == ["antigo.xlsx", "mes_passado.xlsx"]
+
+    # Rodar de novo (cron noturno) não move nada
+    assert main(["--root", str(banco), "--archive-history", "30"]) == 0
+    assert "0 history entries" in capsys.readouterr().out
+
+def test_sem_paths_nem_archive_history(banco):
+    with pytest.raises(SystemExit):
+        main(["--root", str(banco)])
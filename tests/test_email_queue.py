@@ -0,0 +1,127 @@
+"""Fila durável de e-mails (email_outbox) contra um servidor SMTP local do aiosmtpd."""
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from email import message_from_bytes
+
+import pytest
+from aiosmtpd.controller import Controller
+
+import training_engine
+from training_engine import EmailWorker, get_db, queue_email
+
+class Caixa:
+    """Handler do aiosmtpd: guarda as mensagens recebidas e a conexão (peer) de cada uma."""
+
+    def __init__(self, recusar=False):
+        self.recusar = recusar
+        self.mensagens = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if self.recusar:
+            return "550 Mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.mensagens.append((session.peer, message_from_bytes(envelope.content)))
+        return "250 Message accepted"
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def smtp_local(tmp_path, monkeypatch):
+    monkeypatch.setattr(training_engine, "DB_PATH", str(tmp_path / "report_history.db"))
+    monkeypatch.setattr(training_engine, "_db_pool", None)
+    monkeypatch.setattr(training_engine, "_email_worker", None)
+    monkeypatch.setattr(training_engine, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(training_engine, "SMTP_PORT", _porta_livre())
+    monkeypatch.setattr(training_engine, "SMTP_USE_TLS", False)
+    monkeypatch.setattr(training_engine, "SMTP_PASSWORD", "")
+    controladores = []
+
+    def iniciar(recusar=False):
+        caixa = Caixa(recusar)
+        controlador = Controller(caixa, hostname="127.0.0.1", port=training_engine.SMTP_PORT)
+        controlador.start()
+        controladores.append(controlador)
+        return caixa
+    yield iniciar
+    for controlador in controladores:
+        controlador.stop()
+
+def _outbox():
+    with get_db().connection() as conn:
+        return conn.execute("SELECT subject, status, attempts, next_attempt_at, last_error FROM email_outbox "
+                            "ORDER BY id").fetchall()
+
+def test_entrega_varios_emails_numa_so_conexao(smtp_local, tmp_path):
+    caixa = smtp_local()
+    anexo = tmp_path / "final.xlsx"
+    anexo.write_bytes(b"conteudo")
+    for i in range(3):
+        queue_email(f"Report {i}", "Body", "destinatario@exemplo.com", str(anexo) if i == 0 else None)
+
+    worker = EmailWorker(get_db())
+    assert worker.drain() == 3
+    worker.smtp.close()
+
+    assert [m["Subject"] for _, m in caixa.mensagens] == ["Report 0", "Report 1", "Report 2"]
+    assert len({peer for peer, _ in caixa.mensagens}) == 1
+    assert [p.get_filename() for p in caixa.mensagens[0][1].walk() if p.get_filename()] == ["final.xlsx"]
+    assert [(status, attempts) for _, status, attempts, _, _ in _outbox()] == [("sent", 1)] * 3
+
+def test_recusa_tenta_de_novo_com_espera_ate_falhar(smtp_local, monkeypatch):
+    caixa = smtp_local(recusar=True)
+    monkeypatch.setattr(training_engine, "EMAIL_MAX_ATTEMPTS", 3)
+    queue_email("Report", "Body", "destinatario@exemplo.com")
+    worker = EmailWorker(get_db())
+
+    esperas = []
+    for tentativa in range(1, 4):
+        inicio = datetime.now()
+        assert worker.drain() == 1
+        _, status, attempts, proxima, erro = _outbox()[0]
+        assert attempts == tentativa and "Mailbox unavailable" in erro
+        esperas.append((datetime.strptime(proxima, "%Y-%m-%d %H:%M:%S") - inicio).total_seconds())
+        if tentativa < 3:
+            assert status == "pending"
+            assert worker.drain() == 0  # a próxima tentativa ainda não venceu
+            with get_db().connection() as conn:
+                conn.execute("UPDATE email_outbox SET next_attempt_at = '2000-01-01 00:00:00'")
+    assert status == "failed"
+    base = training_engine.EMAIL_RETRY_BASE_SECONDS
+    assert [round(e / base) for e in esperas[:2]] == [1, 2]
+    assert caixa.mensagens == []
+
+def test_worker_sobrevive_a_erro_do_banco(smtp_local, monkeypatch):
+    caixa = smtp_local()
+    monkeypatch.setattr(training_engine, "EMAIL_POLL_SECONDS", 0.05)
+    drain = EmailWorker.drain
+    erros = []
+
+    def drain_com_banco_travado(self, limit=20):
+        if not erros:
+            erros.append(1)
+            raise sqlite3.OperationalError("database is locked")
+        return drain(self, limit)
+    monkeypatch.setattr(EmailWorker, "drain", drain_com_banco_travado)
+
+    worker = training_engine.get_email_worker()
+    queue_email("Report", "Body", "destinatario@exemplo.com")
+    limite = time.monotonic() + 10
+    while not caixa.mensagens and time.monotonic() < limite:
+        time.sleep(0.05)
+    try:
+        assert erros and worker.is_alive()
+        assert [m["Subject"] for _, m in caixa.mensagens] == ["Report"]
+    finally:
+        worker.stop()
+        worker.join(5)
+    assert not worker.is_alive()
+    assert training_engine.get_email_worker() is not worker  # um worker encerrado é substituído
+    training_engine.get_email_worker().stop()
@@ -0,0 +1,73 @@
+"""A conversão xlsx -> Parquet deve devolver os mesmos valores que o pd.read_excel, inclusive em colunas mistas."""
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import training_engine
+from benchmark import generate_dataset
+from training_engine import INPUT_FILE_NAMES, ensure_ingested, process_data, read_input, read_parquet, write_parquet
+
+def _datas_misturadas(datas, rng):
+    """Datas de conclusão digitadas à mão: datas do Excel no meio de "N/A" e datas em texto."""
+    valores = np.array(datas.astype(object), dtype=object)
+    sorteio = rng.random(len(valores))
+    texto_iso = sorteio < 0.15
+    texto_br = (sorteio >= 0.15) & (sorteio < 0.3)
+    valores[texto_iso] = [d.strftime("%Y-%m-%d") if pd.notna(d) else "N/A" for d in valores[texto_iso]]
+    valores[texto_br] = [d.strftime("%d/%m/%Y") if pd.notna(d) else "-" for d in valores[texto_br]]
+    valores[(sorteio >= 0.3) & (sorteio < 0.4)] = "N/A"
+    return valores
+
+@pytest.fixture
+def planilhas_datas_mistas(tmp_path):
+    rng = np.random.default_rng(5)
+    dados = generate_dataset(3000, seed=5)
+    dados["Control.xlsx"]["Date Completed"] = _datas_misturadas(dados["Control.xlsx"]["Date Completed"], rng)
+    dados["Unisea_Sheet.xlsx"]["Revision"] = [rng.choice([f"REV {i % 6}", i % 6, i % 6 + 0.5, None])
+                                              for i in range(len(dados["Unisea_Sheet.xlsx"]))]
+    paths = []
+    for nome in INPUT_FILE_NAMES:
+        dados[nome].to_excel(tmp_path / nome, index=False)
+        paths.append(str(tmp_path / nome))
+    return paths
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_parquet_igual_ao_read_excel(planilhas_datas_mistas, streaming):
+    for path in planilhas_datas_mistas:
+        pd.testing.assert_frame_equal(read_parquet(ensure_ingested(path, streaming)), pd.read_excel(path))
+    control = read_input(planilhas_datas_mistas[2])
+    tipos = set(control["Date Completed"].map(lambda v: type(v).__name__))
+    assert {"datetime", "str", "float"} <= tipos
+
+def test_write_parquet_preserva_tipos_misturados(tmp_path):
+    df = pd.DataFrame({"misturada": [pd.Timestamp("2024-05-15"), "N/A", 3, 2.5, True, None],
+                       "texto": ["a", None, "b", "c", "d", "e"]})
+    write_parquet(df, tmp_path / "x.parquet")
+    lido = read_parquet(tmp_path / "x.parquet")
+    assert [type(v) for v in lido["misturada"][:5]] == [datetime, str, int, float, bool]
+    assert lido["misturada"].tolist()[:5] == df["misturada"].tolist()[:5]
+    assert pd.isna(lido["misturada"][5])
+    assert lido["texto"].fillna("-").tolist() == ["a", "-", "b", "c", "d", "e"]
+
+    # Só colunas mistas: a tabela não pode perder as linhas
+    write_parquet(df[["misturada"]], tmp_path / "y.parquet")
+    assert len(read_parquet(tmp_path / "y.parquet")) == len(df)
+
+def test_relatorio_igual_ao_lido_com_read_excel(planilhas_datas_mistas, monkeypatch):
+    atual = process_data(*planilhas_datas_mistas, workers=1)
+    baixa_memoria = process_data(*planilhas_datas_mistas, workers=1, low_memory=True)
+
+    def read_input_excel(path, columns=None, positions=None):
+        df = pd.read_excel(path)
+        if positions is not None:
+            return df.iloc[:, positions]
+        return df[[c for c in columns if c in df.columns]] if columns is not None else df
+    monkeypatch.setattr(training_engine, "read_input", read_input_excel)
+    esperado = process_data(*planilhas_datas_mistas, workers=1)
+
+    assert ensure_ingested(planilhas_datas_mistas[2])
+    assert atual["control_data_completo"].notna().sum() > 0
+    pd.testing.assert_frame_equal(atual, esperado)
+    pd.testing.assert_frame_equal(baixa_memoria, esperado)
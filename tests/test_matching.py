@@ -0,0 +1,69 @@
+"""O match com o Control deve dar o mesmo resultado com uma ou várias threads."""
+import numpy as np
+import pandas as pd
+
+from benchmark import generate_dataset
+from training_engine import INPUT_FILE_NAMES, match_control, process_data
+
+def _frames_com_empates(n_usuarios=400, n_codigos=12, seed=3):
+    rng = np.random.default_rng(seed)
+    nomes = [f"OPERADOR {i:04d} SILVA" for i in range(n_usuarios)]
+    codigos = [f"P-{i:02d}" for i in range(n_codigos)]
+
+    linhas = []
+    for i, nome in enumerate(nomes):
+        for codigo in rng.choice(codigos, 4, replace=False):
+            data = pd.Timestamp("2024-01-01") + pd.Timedelta(days=int(rng.integers(0, 3)))
+            sorteio = rng.random()
+            if sorteio < 0.3:
+                # Nome exato repetido, às vezes com a mesma data (empate) ou sem data
+                linhas.append((nome, codigo, "REV 1", "Completed", data))
+                linhas.append((nome, codigo, "REV 2", "Completed", data if rng.random() < 0.5 else pd.NaT))
+            elif sorteio < 0.6:
+                # Dois candidatos com o mesmo score fuzzy: prevalece o primeiro
+                linhas.append((nome[:-1] + "B", codigo, "REV 1", "In progress", data))
+                linhas.append((nome[:-1] + "C", codigo, "REV 2", "Completed", data))
+            elif sorteio < 0.9:
+                linhas.append((nome.replace("SILVA", "SILVO"), codigo, "REV 3", "Completed", data))
+            else:
+                linhas.append((None, codigo, "REV 1", "Completed", pd.NaT))
+    df_control = pd.DataFrame(linhas, columns=['nome_padrao', 'procedimento_num_controle', 'rev', 'status',
+                                               'control_data_completo'])
+    df_control = df_control.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+    n = n_usuarios * 6
+    df_result = pd.DataFrame({
+        'nome_padrao': rng.choice(np.array(nomes + [None], dtype=object), n),
+        'procedimento_num_assigned': rng.choice(codigos + ["ZZ"], n),
+        'procedimento_num_alternative': rng.choice(np.array(codigos + [None], dtype=object), n),
+    })
+    return df_result, df_control
+
+def test_match_control_igual_com_varias_threads():
+    df_result, df_control = _frames_com_empates()
+    serial = match_control(df_result, df_control, threshold=80, workers=1)
+    assert (serial['match_score'] == 100).any() and ((serial['match_score'] > 80) & (serial['match_score'] < 100)).any()
+    pd.testing.assert_frame_equal(match_control(df_result, df_control, threshold=80, workers=4), serial)
+
+def test_match_control_empates():
+    df_control = pd.DataFrame({
+        'nome_padrao': ["JOAO SILVB", "JOAO SILVC", "MARIA LIMA", "MARIA LIMA", "MARIA LIMA"],
+        'procedimento_num_controle': "P-01",
+        'rev': ["REV 1", "REV 2", "REV 3", "REV 4", "REV 5"],
+        'status': "Completed",
+        'control_data_completo': pd.to_datetime(["2024-01-01", "2024-01-01", "2024-02-01", "2024-03-01", "2024-03-01"]),
+    })
+    df_result = pd.DataFrame({'nome_padrao': ["JOAO SILVA", "MARIA LIMA"], 'procedimento_num_assigned': "P-01",
+                              'procedimento_num_alternative': None})
+    for workers in (1, 4):
+        saida = match_control(df_result, df_control, threshold=80, workers=workers)
+        assert saida['control_rev'].tolist() == ["REV 1", "REV 4"]
+
+def test_process_data_igual_com_varias_threads(tmp_path):
+    paths = []
+    dados = generate_dataset(3000, typo_rate=0.3, seed=11)
+    for nome in INPUT_FILE_NAMES:
+        dados[nome].to_excel(tmp_path / nome, index=False)
+        paths.append(str(tmp_path / nome))
+    serial = process_data(*paths, workers=1)
+    pd.testing.assert_frame_equal(process_data(*paths, workers=4), serial)
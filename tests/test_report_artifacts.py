@@ -0,0 +1,45 @@
+"""Artefatos do relatório: gravação atômica e limpeza do relatório substituído."""
+import os
+
+import pandas as pd
+import pytest
+
+from training_engine import atomic_write, load_report_manifest, write_report_artifacts
+
+def _relatorio(n):
+    return pd.DataFrame({"Unisea E-learning User": [f"USER {i}" for i in range(n)], "status_final": "OK"})
+
+def _arquivos(pasta):
+    return sorted(os.listdir(pasta))
+
+def test_reprocessar_apaga_o_relatorio_anterior(tmp_path):
+    primeiro = write_report_artifacts(_relatorio(3), str(tmp_path))
+    mesmo = write_report_artifacts(_relatorio(3), str(tmp_path))  # mesmos dados: reaproveita os arquivos
+    assert mesmo["xlsx"] == primeiro["xlsx"] and os.path.exists(primeiro["xlsx"])
+
+    segundo = write_report_artifacts(_relatorio(5), str(tmp_path))
+    assert not os.path.exists(primeiro["xlsx"]) and not os.path.exists(primeiro["parquet"])
+    assert _arquivos(tmp_path) == sorted(["final.json", os.path.basename(segundo["xlsx"]),
+                                          os.path.basename(segundo["parquet"])])
+    assert load_report_manifest(str(tmp_path))["version"] == segundo["version"]
+
+def test_relatorio_legado_e_apagado_ao_gravar_o_manifesto(tmp_path):
+    _relatorio(2).to_excel(tmp_path / "final.xlsx", index=False)
+    novo = write_report_artifacts(_relatorio(2), str(tmp_path))
+    assert not os.path.exists(tmp_path / "final.xlsx")
+    assert os.path.exists(novo["xlsx"])
+
+def test_atomic_write_apaga_o_temporario_em_caso_de_erro(tmp_path):
+    destino = tmp_path / "final.json"
+    destino.write_text("anterior")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(destino)) as temporario:
+            with open(temporario, "w") as f:
+                f.write("pela metade")
+            raise RuntimeError("falha na gravação")
+    assert _arquivos(tmp_path) == ["final.json"]
+    assert destino.read_text() == "anterior"
+
+    with atomic_write(str(destino)) as temporario, open(temporario, "w") as f:
+        f.write("novo")
+    assert _arquivos(tmp_path) == ["final.json"] and destino.read_text() == "novo"
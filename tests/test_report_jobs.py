@@ -0,0 +1,28 @@
+"""ReportJobManager: jobs terminados (e o DataFrame do resultado) não ficam presos na memória."""
+import time
+
+import training_engine
+from training_engine import ReportJobManager
+
+def test_jobs_expirados_saem_no_get_e_no_latest_for(monkeypatch):
+    monkeypatch.setattr(training_engine, "run_report_job", lambda job, **params: {"df_final": object()})
+    manager = ReportJobManager(max_workers=1)
+    job = manager.submit("ana", {})
+    job.future.result()
+    assert manager.get(job.id) is job
+    assert manager.latest_for("ana") is job
+
+    # Sem novos submits, a simples consulta já descarta o job vencido
+    job.finished_at = time.time() - training_engine.REPORT_JOB_RETENTION_SECONDS - 1
+    assert manager.latest_for("ana") is None
+    assert manager.get(job.id) is None
+
+def test_job_em_andamento_nao_expira(monkeypatch):
+    monkeypatch.setattr(training_engine, "REPORT_JOB_RETENTION_SECONDS", 0)
+    monkeypatch.setattr(training_engine, "run_report_job", lambda job, **params: job._cancelar.wait(5))
+    manager = ReportJobManager(max_workers=1)
+    job = manager.submit("ana", {})
+    assert manager.get(job.id) is job
+    job._cancelar.set()
+    job.future.result()
+    assert manager.get(job.id) is None
@@ -0,0 +1,83 @@
+"""compare_revisions (vetorizado) deve dar o mesmo status_final que a comparação linha a linha original."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from training_engine import compare_revisions, extract_revision, extract_revision_series, normalize_text
+
+N_LINHAS = 20_000
+N_CODIGOS = 300
+
+def _status_escalar(control_status, control_rev, rev_unisea):
+    # compare_revs do código original, aplicado linha a linha
+    if normalize_text(control_status) != "completed":
+        return "Not started"
+    rev_control = extract_revision(control_rev)
+    rev_u = extract_revision(rev_unisea)
+    if rev_control is None or rev_u is None:
+        return "OK"
+    return "OK" if rev_control == rev_u else "Retreinamento"
+
+def _revisoes_unisea(tipo, rng):
+    numeros = rng.integers(0, 6, N_CODIGOS)
+    if tipo == "text":
+        return [rng.choice([f"REV {r}", f"Rev.{r:02d}", f"R{r}", f"{r}.5", "sem revisão"]) for r in numeros]
+    if tipo == "int":
+        return [int(r) for r in numeros]
+    if tipo == "float":
+        return [float(r) + rng.choice([0.0, 0.5]) for r in numeros]
+    if tipo == "nan":
+        return [float(r) if rng.random() < 0.6 else np.nan for r in numeros]
+    # mixed: texto (inclusive "2.5", que vira os dígitos 25), inteiros, frações e vazios na mesma coluna
+    return [rng.choice([f"REV {r}", f"{r}.5", int(r), float(r) + 0.7, None]) for r in numeros]
+
+def _resultado_sintetico(rng):
+    codigos = np.array([f"P-{i:04d}" for i in range(N_CODIGOS + 50)], dtype=object)  # 50 sem linha no Unisea
+    return pd.DataFrame({
+        'Unisea E-learning User': [f"USER {i}" for i in range(N_LINHAS)],
+        'cargo_pt_team': "Operador",
+        'cargo_en_team': "Operator",
+        'procedimento_nome': "PROCEDURE",
+        'procedimento_num_assigned': rng.choice(codigos, N_LINHAS),
+        'procedimento_num_alternative': None,
+        'requisito': "Mandatory",
+        'categoria': None,
+        'control_status': rng.choice(["Completed", "completed ", "COMPLETED", "In progress", None], N_LINHAS),
+        'control_nome': "NAME",
+        'control_rev': rng.choice(["REV. 03", "REV. 01", ". 00005", "ABCDEFG", None, "REV. 1X2"], N_LINHAS),
+        'control_data_completo': pd.Timestamp("2024-01-01"),
+        'match_score': 100.0,
+        'inconsistencia': False,
+    })
+
+@pytest.mark.parametrize("tipo", ["text", "int", "float", "nan", "mixed"])
+def test_status_final_igual_ao_escalar(tmp_path, tipo):
+    rng = np.random.default_rng(42)
+    unisea = pd.DataFrame({f"Column {i}": "-" for i in range(1, 9)}, index=range(N_CODIGOS))
+    unisea.insert(0, "Code", [f"P-{i:04d}" for i in range(N_CODIGOS)])
+    unisea["Revision"] = _revisoes_unisea(tipo, rng)
+    unisea_path = tmp_path / "Unisea_Sheet.xlsx"
+    unisea.to_excel(unisea_path, index=False)
+    df_result = _resultado_sintetico(rng)
+
+    saida = compare_revisions(df_result, str(unisea_path))
+
+    # Revisões como o código original as via: lidas do xlsx pelo pandas
+    lidas = pd.read_excel(unisea_path)
+    rev_por_codigo = dict(zip(lidas.iloc[:, 0].astype(str).str.strip(), lidas.iloc[:, 9]))
+    esperado = [_status_escalar(status, rev, rev_por_codigo.get(str(codigo).strip(), np.nan))
+                for status, rev, codigo in zip(df_result['control_status'], df_result['control_rev'],
+                                               df_result['procedimento_num_assigned'])]
+    assert saida['status_final'].tolist() == esperado
+    assert set(esperado) == {"OK", "Retreinamento", "Not started"}
+
+@pytest.mark.parametrize("valores", [
+    [3, 3],
+    [3.0, np.nan, 2.0],
+    ["REV 3", 4, None, 2.7, "sem revisão", np.inf, "R-07"],
+    [],
+])
+def test_extract_revision_series_igual_ao_escalar(valores):
+    serie = pd.Series(valores, dtype=object)
+    esperado = [np.nan if r is None else float(r) for r in (extract_revision(v) for v in valores)]
+    np.testing.assert_array_equal(extract_revision_series(serie).to_numpy(), np.array(esperado, dtype=float))
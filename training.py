@@ -1,56 +1,27 @@
 import streamlit as st  
 import pandas as pd
+import numpy as np
 import sqlite3
 from datetime import datetime
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import io
-import re
-import unicodedata
 import os
-from rapidfuzz import fuzz
-
-# Módulos para envio de e-mail
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+import json
+
+# Motor do relatório (pipeline, banco, artefatos e fila de e-mail), compartilhado com a execução em lote
+from training_engine import (
+    HISTORY_RETENTION_DAYS, INPUT_FILE_NAMES, MAX_WORKERS, PIPELINE_STAGES, REPORT_JOB_STEPS, UPLOAD_DIR,
+    ReportJobManager, archive_report_history, check_login, collect_garbage_blobs, dataset_version, get_db,
+    get_email_worker, get_last_upload_session, get_report_history_filters, get_report_history_page,
+    get_report_metrics, get_report_profile, get_upload_sessions, get_vcp_overview, load_vcp_data, read_file_bytes,
+    read_report, read_report_preview, recalc_vcp, register_upload_session, save_session_inputs, save_vcp_changes,
+    save_vcp_data, serialize_dataframe, session_report_manifest, set_vcp_upload, sync_upload_catalog,
+    update_last_access,
+)
 
 # --- Configurar o layout para "wide" ---
 st.set_page_config(page_title="Training Report - FPSO", layout="wide")
 
-# ========================
-# Email Settings (ajuste conforme necessário)
-# ========================
-SMTP_SERVER = "smtp.gmail.com"
-SMTP_PORT = 587
-SMTP_USERNAME = "seuemail@gmail.com"      # Altere para o seu e-mail
-SMTP_PASSWORD = "suasenha"                  # Altere para sua senha (ou app password)
-EMAIL_RECIPIENT = "destinatario@exemplo.com"  # E-mail do destinatário
-
-def send_email(subject, body, to_email, attachment_path=None):
-    msg = MIMEMultipart()
-    msg['From'] = SMTP_USERNAME
-    msg['To'] = to_email
-    msg['Subject'] = subject
-    msg.attach(MIMEText(body, 'plain'))
-    
-    # Anexa o arquivo, se houver
-    if attachment_path and os.path.exists(attachment_path):
-        with open(attachment_path, "rb") as f:
-            part = MIMEApplication(f.read(), Name=os.path.basename(attachment_path))
-        part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment_path)}"'
-        msg.attach(part)
-    
-    try:
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        st.success("E-mail sent successfully!")
-    except Exception as e:
-        st.error(f"Error sending e-mail: {e}")
-
 # ========================
 # Display company logo
 # ========================
@@ -58,265 +29,301 @@ st.image("logoYP.png", width=200, caption="Yinson Production")
 st.sidebar.image("logoYP.png", width=200, caption="Yinson Production")
 
 # ========================
-# Database Configuration
+# Administração de Usuários
 # ========================
-DB_PATH = "report_history.db"
-
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    # Cria tabela report_history, se não existir
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS report_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        timestamp TEXT,
-        report_type TEXT,
-        file_name TEXT,
-        filter_options TEXT,
-        user TEXT
-    )
-    """)
-    # Cria tabela users, se não existir (apenas com o usuário admin)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT
-    )
-    """)
-    # Verifica se a coluna last_access existe na tabela users e adiciona se não existir
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [row[1] for row in cursor.fetchall()]
-    if "last_access" not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN last_access TEXT")
-    
-    # Insere somente o usuário admin (sem outros usuários)
-    cursor.execute("INSERT OR IGNORE INTO users (username, password, last_access) VALUES (?, ?, ?)", ("admin", "1234", None))
-    conn.commit()
-    conn.close()
-
-def update_last_access(username):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("UPDATE users SET last_access = ? WHERE username = ?", (timestamp, username))
-    conn.commit()
-    conn.close()
-
-def check_login(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def log_report(report_type, file_name, filter_options="", user="Unknown"):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute("""
-        INSERT INTO report_history (timestamp, report_type, file_name, filter_options, user)
-        VALUES (?, ?, ?, ?, ?)
-    """, (timestamp, report_type, file_name, filter_options, user))
-    conn.commit()
-    conn.close()
-
 # Funções para administração de usuários (somente admin)
 def add_user(username, password):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     try:
-        cursor.execute("INSERT INTO users (username, password, last_access) VALUES (?, ?, ?)", (username, password, None))
-        conn.commit()
+        with get_db().connection() as conn:
+            conn.execute("INSERT INTO users (username, password, last_access) VALUES (?, ?, ?)", (username, password, None))
     except Exception as e:
         st.error(f"Error registering user: {e}")
-    finally:
-        conn.close()
 
 def delete_user(username):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM users WHERE username = ?", (username,))
-        conn.commit()
+        with get_db().connection() as conn:
+            conn.execute("DELETE FROM users WHERE username = ?", (username,))
     except Exception as e:
         st.error(f"Error deleting user: {e}")
-    finally:
-        conn.close()
 
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT username, password, last_access FROM users", conn)
-    conn.close()
-    return df
+    with get_db().connection() as conn:
+        return pd.read_sql_query("SELECT username, password, last_access FROM users", conn)
 
 # ========================
-# Utility Functions
+# Processamento em Segundo Plano
 # ========================
-def safe_float(value):
-    try:
-        return float(str(value).strip())
-    except Exception:
-        return None
-
-def extract_revision(rev_str):
-    if isinstance(rev_str, str):
-        digits = re.sub("[^0-9]", "", rev_str)
-        return int(digits) if digits else None
-    try:
-        return int(rev_str)
-    except Exception:
-        return None
-
-def normalize_text(text):
-    try:
-        text = str(text)
-        text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('utf-8')
-        return text.lower().strip()
-    except Exception:
-        return str(text).lower().strip()
+@st.cache_resource
+def get_job_manager():
+    return ReportJobManager()
+
+def show_report_job_progress(job_id):
+    """Painel de andamento do job (executado como fragmento com atualização periódica)."""
+    job = get_job_manager().get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    if job.status == "queued":
+        st.info("Report queued, waiting for a free worker...")
+    else:
+        st.progress(job.progress, text=f"Processing: {job.step_name} ({job.step_index + 1}/{len(REPORT_JOB_STEPS)})")
+    if st.button("Cancel processing", key=f"cancel_{job.id}"):
+        job.cancel()
 
 # ========================
-# Funções de Persistência para a Tabela VCP
+# Painel de Desempenho
 # ========================
-def load_vcp_data():
-    """Carrega os dados do VCP de um arquivo CSV, se existir."""
-    file_path = "vcp_data.csv"
-    if os.path.exists(file_path):
-        return pd.read_csv(file_path)
+PERFORMANCE_BASELINE_RUNS = 10         # processamentos anteriores usados como referência
+PERFORMANCE_REGRESSION_RATIO = 1.5     # acima disso (segundos por mil linhas vs mediana), o painel avisa
+
+def stage_seconds_table(df_metricas):
+    """Segundos de cada etapa por processamento (uma coluna por etapa), indexado pela data do processamento."""
+    tempos = pd.DataFrame([{etapa["name"]: etapa["seconds"] for etapa in etapas} for etapas in df_metricas["stages"]])
+    tempos.index = pd.to_datetime(df_metricas["recorded_at"])
+    return tempos
+
+def show_performance_panel():
+    """Tempos por etapa, tendências entre processamentos e cProfile de cada processamento (aba Admin)."""
+    df_metricas = get_report_metrics()
+    if df_metricas.empty:
+        st.info("No processing runs recorded yet.")
+        return
+    datas = pd.to_datetime(df_metricas["recorded_at"])
+    por_mil = pd.Series((df_metricas["total_seconds"] / df_metricas["row_count"].clip(lower=1) * 1000).to_numpy(),
+                        index=datas, name="Seconds per 1,000 rows")
+    ultima = df_metricas.iloc[-1]
+    referencia = por_mil.iloc[-(PERFORMANCE_BASELINE_RUNS + 1):-1].median()
+
+    col_tempo, col_linhas, col_memoria = st.columns(3)
+    variacao = f"{(por_mil.iloc[-1] / referencia - 1) * 100:+.0f}% per 1k rows vs median" if pd.notna(referencia) else None
+    col_tempo.metric("Last run", f"{ultima['total_seconds']:.1f} s", delta=variacao, delta_color="inverse")
+    col_linhas.metric("Rows", f"{int(ultima['row_count']):,}")
+    col_memoria.metric("Peak memory", f"{ultima['peak_rss_mb']:.0f} MB" if pd.notna(ultima["peak_rss_mb"]) else "n/a")
+    if pd.notna(referencia) and por_mil.iloc[-1] > referencia * PERFORMANCE_REGRESSION_RATIO:
+        st.warning(f"The last run took {por_mil.iloc[-1]:.2f} s per 1,000 rows, above "
+                   f"{PERFORMANCE_REGRESSION_RATIO:g}x the median of the previous {PERFORMANCE_BASELINE_RUNS} runs.")
+
+    st.markdown("**Time per stage (s)**")
+    st.area_chart(stage_seconds_table(df_metricas))
+    col_escala, col_pico = st.columns(2)
+    col_escala.markdown("**Seconds per 1,000 rows**")
+    col_escala.line_chart(por_mil)
+    col_pico.markdown("**Peak memory (MB)**")
+    col_pico.line_chart(pd.Series(df_metricas["peak_rss_mb"].to_numpy(), index=datas, name="Peak memory (MB)"))
+
+    escolhido = st.selectbox(
+        "Run details", df_metricas.index[::-1], key="perf_run",
+        format_func=lambda i: (f"{df_metricas.at[i, 'recorded_at']} | {df_metricas.at[i, 'user'] or '-'} | "
+                               f"{df_metricas.at[i, 'total_seconds']:.1f} s | {df_metricas.at[i, 'row_count']} rows"))
+    execucao = df_metricas.loc[escolhido]
+    st.caption(f"Session: {execucao['session_folder']}"
+               + (f" | History entry #{int(execucao['history_id'])}" if pd.notna(execucao["history_id"]) else ""))
+    st.dataframe(pd.DataFrame(execucao["stages"]), hide_index=True)
+    if execucao["has_profile"]:
+        with st.expander("cProfile (top functions by cumulative time)"):
+            st.code(get_report_profile(int(execucao["id"])), language=None)
     else:
-        return None
+        st.caption("No cProfile captured for this run (enable it when processing a report).")
+
+# ========================
+# Índice de Busca Global
+# ========================
+SEARCH_SEPARATOR = "\x1f"  # separa as colunas no texto indexado; não aparece em dados digitados
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_search_index(_df, version):
+    """Texto em minúsculas de todas as colunas de cada linha, construído uma vez por versão dos dados."""
+    textos = [_df[col].astype(object).astype(str).fillna("").str.lower() for col in _df.columns]
+    if not textos:
+        return pd.Series("", index=_df.index)
+    return textos[0].str.cat(textos[1:], sep=SEARCH_SEPARATOR)
+
+def search_dataframe(df, search_term, version):
+    """Linhas em que algum valor contém search_term (substring, sem diferenciar maiúsculas)."""
+    if not search_term:
+        return df
+    indice = build_search_index(df, version)
+    return df[indice.str.contains(search_term.lower(), regex=False).to_numpy()]
 
-def save_vcp_data(df):
-    """Salva os dados do VCP em um arquivo CSV."""
-    file_path = "vcp_data.csv"
-    df.to_csv(file_path, index=False)
+# ========================
+# Agregações dos Relatórios
+# ========================
+STATUS_LABELS = ['OK', 'Retreinamento', 'Not started']
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_report_rollups(_df, version):
+    """Todas as agregações das abas Visualization e Relatório Gerencial, calculadas uma vez por versão dos dados.
+
+    Cada bloco faz um único groupby sobre as colunas necessárias; as tabelas exibidas são
+    derivadas desses resultados pequenos, então trocar de aba não reprocessa o DataFrame.
+    """
+    rollups = {}
+
+    # Visualization: contagem por cargo x status (os nulos entram para o total de cada status)
+    if "status_final" in _df.columns:
+        cargos = _df["cargo_pt_team"] if "cargo_pt_team" in _df.columns else pd.Series(np.nan, index=_df.index)
+        por_cargo = (pd.DataFrame({"cargo_pt_team": cargos, "status_final": _df["status_final"]})
+                     .groupby(["cargo_pt_team", "status_final"], observed=True, dropna=False).size())
+        status_counts = por_cargo.groupby(level="status_final", observed=True).sum()
+        rollups["status_counts"] = {label: int(status_counts.get(label, 0)) for label in STATUS_LABELS}
+        conhecidos = por_cargo[por_cargo.index.get_level_values("cargo_pt_team").notna()
+                               & por_cargo.index.get_level_values("status_final").notna()]
+        rollups["status_by_position"] = (conhecidos.unstack(fill_value=0)
+                                         if "cargo_pt_team" in _df.columns and not conhecidos.empty else None)
+
+    # Relatório Gerencial: só linhas com data de conclusão, agrupadas por mês x concluído x VCP
+    if "control_data_completo" not in _df.columns:
+        rollups["monthly"] = None
+        return rollups
+    base = _df.dropna(subset=["control_data_completo"])
+    concluido = base["status_final"].str.upper().eq("OK").fillna(False).to_numpy(dtype=bool)
+    vcp = base["procedimento_nome"].astype(object).str.contains("vcp", case=False, na=False).to_numpy(dtype=bool)
+    contagem = (pd.DataFrame({"mes": base["control_data_completo"].dt.to_period("M"), "ok": concluido, "vcp": vcp})
+                .groupby(["mes", "ok", "vcp"]).size())
+
+    planejado = contagem.groupby(level="mes").sum()
+    concluidos_mes = contagem[contagem.index.get_level_values("ok")].groupby(level="mes").sum()
+    overview = pd.DataFrame({
+        "mes_ano": planejado.index.astype(str),
+        "planejado": planejado.to_numpy(),
+        "concluidos": concluidos_mes.reindex(planejado.index, fill_value=0).to_numpy(),
+    })
+    overview["percentual"] = (overview["concluidos"] / overview["planejado"]) * 100
+
+    completos = contagem[contagem.index.get_level_values("ok")].reset_index(name="completos")
+    completos["training_type"] = np.where(completos["vcp"], "R & VCP", "R")
+    resumo_mes = (completos.groupby(["mes", "training_type"])["completos"].sum().reset_index()
+                  .rename(columns={"mes": "control_data_completo"}))
+    resumo_mes["mes_ano"] = resumo_mes["control_data_completo"].astype(str)
+
+    rollups["monthly"] = {
+        "overview": overview,
+        "by_type": resumo_mes,
+        # Tipos na ordem em que aparecem nos dados (ordem das barras no gráfico)
+        "training_types": list(pd.unique(np.where(vcp[concluido], "R & VCP", "R"))),
+        "vcp_planned": int(vcp.sum()),
+        "vcp_completed": int((vcp & concluido).sum()),
+    }
+    return rollups
 
 # ========================
-# Data Processing Function
+# Gráficos dos Dashboards
 # ========================
-def process_data(team_file, train_file, control_file, training_type_file=None, unisea_file=None, fuzzy_threshold=80):
+CHART_MAX_STATIC_POSITIONS = 30  # acima disso, Status by Position usa o gráfico interativo do Streamlit
+
+def _figura_png(fig):
+    """PNG de uma figura; a figura é descartada logo em seguida."""
+    buffer = io.BytesIO()
     try:
-        # Lê o arquivo Team e separa as colunas de posição
-        df_team = pd.read_excel(team_file)
-        if "Position in Matrix" not in df_team.columns:
-            st.error("Column 'Position in Matrix' not found in Team.xlsx.")
-            return None
-        df_team[['cargo_en_team', 'cargo_pt_team']] = df_team["Position in Matrix"].str.split("\n", n=1, expand=True)
-        df_team['cargo_en_team'] = df_team['cargo_en_team'].str.strip()
-        df_team['cargo_pt_team'] = df_team['cargo_pt_team'].str.strip()
-
-        # Lê o arquivo Trainings
-        df_train = pd.read_excel(train_file).iloc[:, :6]
-        df_train.columns = ['cargo_en_train', 'cargo_pt_train', 'procedimento_nome',
-                            'procedimento_num_en', 'procedimento_num_pt', 'requisito']
-        df_merged = pd.merge(df_team, df_train, left_on='cargo_pt_team', right_on='cargo_pt_train', how='left')
-        df_merged['procedimento_num_assigned'] = df_merged.apply(
-            lambda row: row['procedimento_num_pt'] if str(row.get('Nationality', '')).upper() == 'BR' 
-                        else row['procedimento_num_en'], axis=1)
-        df_merged['procedimento_num_alternative'] = df_merged.apply(
-            lambda row: row['procedimento_num_en'] if str(row.get('Nationality', '')).upper() == 'BR'
-                        else row['procedimento_num_pt'], axis=1)
-        df_result = df_merged[['Unisea E-learning User', 'cargo_pt_team', 'cargo_en_team',
-                               'procedimento_nome', 'procedimento_num_assigned',
-                               'procedimento_num_alternative', 'requisito']]
-
-        # Lê o arquivo Control
-        df_control = pd.read_excel(control_file)
-        df_control['nome_padrao'] = df_control.iloc[:, 0].astype(str).str.upper().str.strip()
-        df_control['procedimento_num_controle'] = df_control.iloc[:, 4].astype(str).str.strip()
-        df_control['procedimento_nome_controle'] = df_control.iloc[:, 5].astype(str).str.upper().str.strip()
-        df_control['rev'] = df_control['procedimento_nome_controle'].str[-7:]
-        df_control['status'] = df_control.iloc[:, 8]
-        df_control['control_data_completo'] = pd.to_datetime(df_control.iloc[:, 9], errors='coerce')
-        df_result['nome_padrao'] = df_result['Unisea E-learning User'].astype(str).str.upper().str.strip()
-
-        # Função para fazer match com o Control
-        def match_control(row, threshold=fuzzy_threshold):
-            codigo_atribuido = str(row['procedimento_num_assigned']).strip()
-            codigo_alternativo = (str(row['procedimento_num_alternative']).strip() if pd.notnull(row.get('procedimento_num_alternative')) else '')
-            codigos = list({codigo_atribuido, codigo_alternativo}) if codigo_alternativo else [codigo_atribuido]
-            nome_usuario = row['nome_padrao']
-            candidatos = df_control[df_control['procedimento_num_controle'].isin(codigos)]
-            if candidatos.empty:
-                return pd.Series([None, None, None, None, 0])
-            correspondencias_exatas = candidatos[candidatos['nome_padrao'] == nome_usuario]
-            if not correspondencias_exatas.empty:
-                if not correspondencias_exatas['control_data_completo'].dropna().empty:
-                    melhor = correspondencias_exatas.loc[correspondencias_exatas['control_data_completo'].idxmax()]
-                else:
-                    melhor = correspondencias_exatas.iloc[0]
-                return pd.Series([melhor['status'], melhor['control_data_completo'], 
-                                  melhor['nome_padrao'], melhor['rev'], 100])
-            melhor_score, melhor_candidato = 0, None
-            for _, cand in candidatos.iterrows():
-                score = fuzz.ratio(normalize_text(nome_usuario), normalize_text(cand['nome_padrao']))
-                if score > melhor_score:
-                    melhor_score, melhor_candidato = score, cand
-            if melhor_score >= threshold and melhor_candidato is not None:
-                return pd.Series([melhor_candidato['status'], melhor_candidato['control_data_completo'],
-                                  melhor_candidato['nome_padrao'], melhor_candidato['rev'], melhor_score])
-            return pd.Series([None, None, None, None, melhor_score])
-
-        df_result[['control_status', 'control_data_completo', 'control_nome', 'control_rev', 'match_score']] = df_result.apply(match_control, axis=1)
-        df_result['inconsistencia'] = df_result['control_status'].isnull() | (df_result['match_score'] < 100)
-
-        # Processa o arquivo Training Type (opcional)
-        if training_type_file is not None:
-            df_type = pd.read_excel(training_type_file).iloc[:, :3]
-            df_type.columns = ['procedimento_num_en_type', 'procedimento_num_pt_type', 'categoria']
-            def get_categoria(procedimento):
-                procedimento = str(procedimento).strip()
-                match = df_type[(df_type['procedimento_num_en_type'].astype(str).str.strip() == procedimento) |
-                                (df_type['procedimento_num_pt_type'].astype(str).str.strip() == procedimento)]
-                if not match.empty:
-                    return match.iloc[0]['categoria']
-                return None
-            df_result['categoria'] = df_result['procedimento_num_assigned'].apply(get_categoria)
-        else:
-            df_result['categoria'] = None
-
-        # Processa o arquivo Unisea (opcional)
-        if unisea_file is not None:
-            df_unisea = pd.read_excel(unisea_file)
-            df_unisea = df_unisea.rename(columns={df_unisea.columns[0]: 'procedimento_num_unisea',
-                                                  df_unisea.columns[9]: 'rev_unisea'})
-            df_unisea['procedimento_num_unisea'] = df_unisea['procedimento_num_unisea'].astype(str).str.strip()
-            df_result['procedimento_num_assigned'] = df_result['procedimento_num_assigned'].astype(str).str.strip()
-            df_result = df_result.merge(df_unisea[['procedimento_num_unisea', 'rev_unisea']],
-                                         left_on='procedimento_num_assigned',
-                                         right_on='procedimento_num_unisea', how='left')
-            df_result.drop(columns=['procedimento_num_unisea'], inplace=True)
-            def compare_revs(row):
-                if normalize_text(row.get('control_status')) != "completed":
-                    return "Not started"
-                rev_control_extracted = extract_revision(row['control_rev'])
-                rev_unisea_extracted = extract_revision(row['rev_unisea'])
-                if rev_control_extracted is None or rev_unisea_extracted is None:
-                    return "OK"
-                if rev_control_extracted == rev_unisea_extracted:
-                    return "OK"
-                else:
-                    return "Retreinamento"
-            df_result['status_final'] = df_result.apply(compare_revs, axis=1)
-        else:
-            df_result['status_final'] = df_result['control_status']
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+    finally:
+        fig.clear()
+    return buffer.getvalue()
+
+# As figuras são criadas com Figure (e não plt.subplots), então nunca entram no registro global
+# do pyplot; cada gráfico fica em cache como PNG, indexado pelos dados agregados que desenha.
+@st.cache_data(show_spinner=False, max_entries=32)
+def chart_status_pie(labels, data):
+    fig = Figure()
+    ax = fig.subplots()
+    ax.pie(data, labels=labels, autopct='%1.1f%%', startangle=90)
+    ax.axis('equal')
+    return _figura_png(fig)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def chart_status_by_position(group):
+    fig = Figure(figsize=(8, 4))
+    ax = fig.subplots()
+    group.plot(kind='bar', ax=ax)
+    ax.set_title("Status by Position")
+    return _figura_png(fig)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def chart_monthly_completion(overview):
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    ax.plot(overview['mes_ano'], overview['percentual'], marker='o')
+    ax.set_xlabel("Mês/Ano")
+    ax.set_ylabel("Percentual de Conclusão (%)")
+    ax.set_title("Evolução Mensal dos Treinamentos Concluídos")
+    ax.tick_params(axis='x', labelrotation=45)
+    return _figura_png(fig)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def chart_completed_by_type(resumo_mes, training_types):
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    for t in training_types:
+        dados = resumo_mes[resumo_mes['training_type'] == t]
+        ax.bar(dados['mes_ano'], dados['completos'], label=t)
+    ax.set_xlabel("Mês/Ano")
+    ax.set_ylabel("Número de Treinamentos Concluídos")
+    ax.set_title("Treinamentos Concluídos por Mês e Tipo")
+    ax.legend()
+    ax.tick_params(axis='x', labelrotation=45)
+    return _figura_png(fig)
 
-        colunas_final = ['Unisea E-learning User', 'cargo_pt_team', 'cargo_en_team', 'procedimento_nome',
-                         'procedimento_num_assigned', 'procedimento_num_alternative', 'requisito',
-                         'categoria', 'control_status', 'control_nome', 'control_rev', 'rev_unisea',
-                         'status_final', 'control_data_completo', 'match_score', 'inconsistencia']
-        df_final = df_result[colunas_final]
-        return df_final
+# ========================
+# Exportação de Dados
+# ========================
+EXCEL_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_FORMATS = {
+    "Excel (.xlsx)": ("xlsx", EXCEL_MIME),
+    "CSV (.csv)": ("csv", "text/csv"),
+    "Parquet (.parquet)": ("parquet", "application/vnd.apache.parquet"),
+}
+EXPORT_CACHE_ENTRIES = 32
+
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES)
+def export_bytes(_df, version, filter_key, fmt, sheet_name="Sheet1"):
+    """Arquivo exportado, guardado por versão dos dados, estado dos filtros e formato.
+
+    _df pode ser uma função que carrega os dados; ela só é chamada se o arquivo não estiver em cache.
+    """
+    df = _df() if callable(_df) else _df
+    return serialize_dataframe(df, fmt, sheet_name)
+
+def export_download_button(label, df, version, file_stem, key, filter_state=None, sheet_name="Sheet1",
+                           xlsx_file=None):
+    """Botão de download com escolha de formato.
+
+    O arquivo só é gerado quando o usuário clica (data recebe uma função) e fica em cache
+    para a mesma combinação de dados, filtros e formato; reruns da página não serializam nada.
+    Se xlsx_file for informado (relatório já gravado), o Excel é servido direto desse arquivo.
+    """
+    col_formato, col_botao = st.columns([1, 2])
+    formato = col_formato.selectbox("Export format", list(EXPORT_FORMATS), key=f"{key}_format",
+                                    label_visibility="collapsed")
+    ext, mime = EXPORT_FORMATS[formato]
+    filter_key = json.dumps(filter_state, sort_keys=True, default=str) if filter_state else ""
+    if ext == "xlsx" and xlsx_file is not None and os.path.exists(xlsx_file):  # um reprocessamento da sessão o substitui
+        gerar = lambda: read_file_bytes(xlsx_file)
+    else:
+        gerar = lambda: export_bytes(df, version, filter_key, ext, sheet_name)
+    col_botao.download_button(label=label,
+                              data=gerar,
+                              file_name=f"{file_stem}.{ext}",
+                              mime=mime,
+                              key=key,
+                              on_click="ignore")
 
-    except Exception as e:
-        st.error(f"An error occurred while processing data: {e}")
-        return None
+# ========================
+# Catálogo de Sessões de Upload
+# ========================
+def describe_upload_session(sessao):
+    data = sessao["created_at"] or "Unknown Date"
+    return f"{data} ({sessao['row_count']} rows)" if sessao["row_count"] is not None else data
 
 # ========================
 # Inicializa o Banco de Dados e Sistema de Login
 # ========================
-init_db()
+@st.cache_resource
+def iniciar_servicos():
+    """Migra o banco, cataloga as sessões antigas e inicia o worker de e-mail, uma vez por processo."""
+    get_db()
+    sync_upload_catalog()
+    get_email_worker()
+
+iniciar_servicos()
 
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -342,8 +349,9 @@ if st.session_state.get('logged_in'):
     st.title(f"Training Report - FPSO | Logged in as: {st.session_state.username}")
     
     # Define as abas de navegação; inclui "Admin" somente para o usuário admin
+    is_admin = st.session_state.username.lower() == "admin"
     tabs_list = ["Report", "Filters", "Visualization", "Full Table", "Saved Uploads", "History", "VCP", "Relatório Gerencial"]
-    if st.session_state.username.lower() == "admin":
+    if is_admin:
         tabs_list.append("Admin")
     tabs = st.tabs(tabs_list)
     
@@ -358,92 +366,54 @@ if st.session_state.get('logged_in'):
             control_file = st.file_uploader("Control.xlsx", type=["xlsx"], key="control")
             training_type_file = st.file_uploader("Training Type Listing (optional)", type=["xlsx"], key="training_type")
             unisea_file = st.file_uploader("Unisea Sheet (optional)", type=["xlsx"], key="unisea")
-            fuzzy_threshold = st.number_input("Fuzzy Threshold:", min_value=0, max_value=100, value=80)
+            col_threshold, col_workers = st.columns(2)
+            fuzzy_threshold = col_threshold.number_input("Fuzzy Threshold:", min_value=0, max_value=100, value=80)
+            workers = col_workers.number_input("Workers (parallel matching):", min_value=1, max_value=MAX_WORKERS, value=1)
+            low_memory = st.checkbox("Low-memory mode (very large Control files)", key="low_memory")
+            profile = is_admin and st.checkbox("Capture profile (cProfile) for the Performance panel", key="capture_profile")
             
             if st.button("Process Data"):
                 if not (team_file and train_file and control_file):
                     st.error("You must upload the Team, Trainings, and Control files.")
                 else:
-                    with st.spinner("Processing data..."):
-                        upload_dir = "uploaded_files"
-                        if not os.path.exists(upload_dir):
-                            os.makedirs(upload_dir)
-                        timestamp_folder = datetime.now().strftime("%Y%m%d%H%M%S")
-                        session_folder = os.path.join(upload_dir, timestamp_folder)
-                        os.makedirs(session_folder)
-                        
-                        team_path = os.path.join(session_folder, "Team.xlsx")
-                        with open(team_path, "wb") as f:
-                            f.write(team_file.getbuffer())
-                        
-                        train_path = os.path.join(session_folder, "Trainings.xlsx")
-                        with open(train_path, "wb") as f:
-                            f.write(train_file.getbuffer())
-                        
-                        control_path = os.path.join(session_folder, "Control.xlsx")
-                        with open(control_path, "wb") as f:
-                            f.write(control_file.getbuffer())
-                        
-                        training_type_path = None
-                        if training_type_file:
-                            training_type_path = os.path.join(session_folder, "Training_Type_Listing.xlsx")
-                            with open(training_type_path, "wb") as f:
-                                f.write(training_type_file.getbuffer())
-                        
-                        unisea_path = None
-                        if unisea_file:
-                            unisea_path = os.path.join(session_folder, "Unisea_Sheet.xlsx")
-                            with open(unisea_path, "wb") as f:
-                                f.write(unisea_file.getbuffer())
-                        
-                        df_final = process_data(team_path, train_path, control_path, training_type_path, unisea_path, fuzzy_threshold)
-                        
-                        final_data_path = os.path.join(session_folder, "final.xlsx")
-                        if df_final is not None:
-                            df_final.to_excel(final_data_path, index=False)
+                    if not os.path.exists(UPLOAD_DIR):
+                        os.makedirs(UPLOAD_DIR)
+                    timestamp_folder = datetime.now().strftime("%Y%m%d%H%M%S")
+                    session_folder = os.path.join(UPLOAD_DIR, timestamp_folder)
+                    os.makedirs(session_folder)
                     
-                    if df_final is not None:
-                        st.session_state.df_final = df_final
-                        st.success("Report processed successfully!")
-
-                        # Inserir a chamada para log do relatório aqui:
-                        log_report(report_type="Training Report", file_name=final_data_path, filter_options="", user=st.session_state.username)
-    
-                        st.write("Displaying first 5 records:")
-                        st.dataframe(df_final.head())
-                        
-                        buffer = io.BytesIO()
-                        df_final.to_excel(buffer, index=False)
-                        st.download_button(label="Download Full Table",
-                                           data=buffer,
-                                           file_name=f"Training_Status_Full_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-                                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                        
-                        email_subject = "Training Report Finalized"
-                        email_body = "The report was processed successfully. Attached is the final file."
-                        send_email(email_subject, email_body, EMAIL_RECIPIENT, attachment_path=final_data_path)
+                    # Os arquivos são só gravados aqui; a conversão e o processamento rodam no job
+                    input_paths = save_session_inputs(session_folder, {
+                        "Team.xlsx": team_file,
+                        "Trainings.xlsx": train_file,
+                        "Control.xlsx": control_file,
+                        "Training_Type_Listing.xlsx": training_type_file,
+                        "Unisea_Sheet.xlsx": unisea_file,
+                    })
+                    register_upload_session(session_folder, st.session_state.username)
+                    
+                    job = get_job_manager().submit(st.session_state.username, dict(
+                        paths=tuple(input_paths.get(nome) for nome in INPUT_FILE_NAMES),
+                        fuzzy_threshold=fuzzy_threshold, workers=workers, low_memory=low_memory,
+                        session_folder=session_folder, username=st.session_state.username, log_history=True,
+                        profile=profile))
+                    st.session_state.report_job_id = job.id
+                    st.session_state.report_job_download = ("Download Full Table", "Training_Status_Full")
         
         else:  # Use Last Upload with individual replacement
-            upload_dir = "uploaded_files"
-            if not os.path.exists(upload_dir):
+            last_entry = get_last_upload_session()
+            if last_entry is None:
                 st.error("No saved upload found. Please do a new upload.")
             else:
-                sessions = [os.path.join(upload_dir, d) for d in os.listdir(upload_dir) if os.path.isdir(os.path.join(upload_dir, d))]
-                if not sessions:
-                    st.error("No saved upload found. Please do a new upload.")
+                if not os.path.isdir(last_entry["folder"]):
+                    st.error("The last upload folder is no longer available on disk. Please do a new upload.")
                 else:
-                    last_session = sorted(sessions)[-1]
-                    last_session_name = os.path.basename(last_session)
-                    try:
-                        last_upload_date = datetime.strptime(last_session_name, "%Y%m%d%H%M%S")
-                        last_upload_date_str = last_upload_date.strftime("%Y-%m-%d %H:%M:%S")
-                    except Exception:
-                        last_upload_date_str = "Unknown Date"
+                    last_session = last_entry["folder"]
+                    last_upload_date_str = last_entry["created_at"] or "Unknown Date"
                     
                     st.info(f"Last upload made on: {last_upload_date_str}")
                     st.write("Files available in the last upload:")
-                    files_available = os.listdir(last_session)
-                    st.write(files_available)
+                    st.write(sorted(last_entry["file_hashes"]))
                     
                     st.markdown("### Replace files (optional)")
                     team_file_new = st.file_uploader("Replace Team.xlsx", type=["xlsx"], key="team_replace")
@@ -452,58 +422,68 @@ if st.session_state.get('logged_in'):
                     training_type_file_new = st.file_uploader("Replace Training Type Listing (optional)", type=["xlsx"], key="training_type_replace")
                     unisea_file_new = st.file_uploader("Replace Unisea Sheet (optional)", type=["xlsx"], key="unisea_replace")
                     
-                    fuzzy_threshold = st.number_input("Fuzzy Threshold:", min_value=0, max_value=100, value=80)
+                    col_threshold, col_workers = st.columns(2)
+                    fuzzy_threshold = col_threshold.number_input("Fuzzy Threshold:", min_value=0, max_value=100, value=80, key="fuzzy_threshold_replace")
+                    workers = col_workers.number_input("Workers (parallel matching):", min_value=1, max_value=MAX_WORKERS, value=1, key="workers_replace")
+                    low_memory = st.checkbox("Low-memory mode (very large Control files)", key="low_memory_replace")
+                    profile = is_admin and st.checkbox("Capture profile (cProfile) for the Performance panel",
+                                                       key="capture_profile_replace")
                     if st.button("Process Data from Last Upload"):
-                        with st.spinner("Processing data..."):
-                            team_path = os.path.join(last_session, "Team.xlsx")
-                            if team_file_new is not None:
-                                with open(team_path, "wb") as f:
-                                    f.write(team_file_new.getbuffer())
-                            train_path = os.path.join(last_session, "Trainings.xlsx")
-                            if train_file_new is not None:
-                                with open(train_path, "wb") as f:
-                                    f.write(train_file_new.getbuffer())
-                            control_path = os.path.join(last_session, "Control.xlsx")
-                            if control_file_new is not None:
-                                with open(control_path, "wb") as f:
-                                    f.write(control_file_new.getbuffer())
-                            training_type_path = os.path.join(last_session, "Training_Type_Listing.xlsx")
-                            if training_type_file_new is not None:
-                                with open(training_type_path, "wb") as f:
-                                    f.write(training_type_file_new.getbuffer())
-                            else:
-                                if not os.path.exists(training_type_path):
-                                    training_type_path = None
-                            unisea_path = os.path.join(last_session, "Unisea_Sheet.xlsx")
-                            if unisea_file_new is not None:
-                                with open(unisea_path, "wb") as f:
-                                    f.write(unisea_file_new.getbuffer())
-                            else:
-                                if not os.path.exists(unisea_path):
-                                    unisea_path = None
-                            
-                            df_final = process_data(team_path, train_path, control_path, training_type_path, unisea_path, fuzzy_threshold)
-                            
-                            final_data_path = os.path.join(last_session, "final.xlsx")
-                            if df_final is not None:
-                                df_final.to_excel(final_data_path, index=False)
+                        # Arquivos não substituídos continuam apontando para os blobs da sessão
+                        input_paths = save_session_inputs(last_session, {
+                            "Team.xlsx": team_file_new,
+                            "Trainings.xlsx": train_file_new,
+                            "Control.xlsx": control_file_new,
+                            "Training_Type_Listing.xlsx": training_type_file_new,
+                            "Unisea_Sheet.xlsx": unisea_file_new,
+                        })
+                        register_upload_session(last_session, st.session_state.username)
                         
-                        if df_final is not None:
-                            st.session_state.df_final = df_final
-                            st.success("Report processed successfully!")
-                            st.write("Displaying first 5 records:")
-                            st.dataframe(df_final.head())
-                            
-                            buffer = io.BytesIO()
-                            df_final.to_excel(buffer, index=False)
-                            st.download_button(label="Download Customized Data",
-                                               data=buffer,
-                                               file_name=f"Training_Status_Custom_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-                                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                            
-                            email_subject = "Training Report Finalized"
-                            email_body = "The report was processed successfully. Attached is the final file."
-                            send_email(email_subject, email_body, EMAIL_RECIPIENT, attachment_path=final_data_path)
+                        job = get_job_manager().submit(st.session_state.username, dict(
+                            paths=tuple(input_paths.get(nome) for nome in INPUT_FILE_NAMES),
+                            fuzzy_threshold=fuzzy_threshold, workers=workers, low_memory=low_memory,
+                            session_folder=last_session, username=st.session_state.username, log_history=False,
+                            profile=profile))
+                        st.session_state.report_job_id = job.id
+                        st.session_state.report_job_download = ("Download Customized Data", "Training_Status_Custom")
+        
+        # --- Andamento / resultado do último processamento (sobrevive a reruns e a recarregar a página) ---
+        job_manager = get_job_manager()
+        job = job_manager.get(st.session_state.get("report_job_id")) or job_manager.latest_for(st.session_state.username)
+        if job is not None and not job.finished:
+            st.fragment(show_report_job_progress, run_every=1)(job.id)
+        elif job is not None and job.status == "done":
+            reused_stages = job.result["reused_stages"]
+            manifest = job.result["manifest"]
+            if st.session_state.get("report_job_attached") != job.id:
+                # O job entrega o DataFrame uma única vez; as outras sessões o recarregam do Parquet do manifesto
+                df_final = job.result.pop("df_final", None)
+                if df_final is None:
+                    df_final = read_report(manifest)
+                st.session_state.df_final = df_final
+                st.session_state.df_final_version = manifest["version"]
+                st.session_state.report_job_attached = job.id
+            df_final = st.session_state.df_final
+            st.success("Report processed successfully!")
+            if reused_stages:
+                st.caption(f"Reused cached stages: {', '.join(reused_stages)} ({len(reused_stages)}/{len(PIPELINE_STAGES)}).")
+            else:
+                st.caption("No cached stages reused: full pipeline executed.")
+            metricas = job.result["metrics"]
+            pico = f", peak memory {metricas.peak_rss_mb:.0f} MB" if metricas.peak_rss_mb is not None else ""
+            st.caption(f"Processed in {metricas.total_seconds:.1f} s{pico}.")
+            st.write("Displaying first 5 records:")
+            st.dataframe(df_final.head())
+            
+            download_label, download_prefix = st.session_state.get("report_job_download", ("Download Full Table", "Training_Status_Full"))
+            export_download_button(download_label, df_final, manifest["version"],
+                                   f"{download_prefix}_{datetime.now().strftime('%Y-%m-%d')}", key="export_report",
+                                   xlsx_file=manifest["xlsx"])
+            st.info("E-mail queued for delivery.")
+        elif job is not None and job.status == "failed":
+            st.error(f"An error occurred while processing data: {job.error}")
+        elif job is not None and job.status == "cancelled":
+            st.warning("Processing cancelled.")
     
     # ----- Aba Filters -----
     with tabs[1]:
@@ -511,32 +491,33 @@ if st.session_state.get('logged_in'):
         if st.session_state.get('df_final') is None:
             st.error("No processed data available for filtering. Go to the 'Report' tab and process the data.")
         else:
-            df_final = st.session_state.df_final.copy()
-            cargos = sorted(df_final['cargo_pt_team'].dropna().unique())
+            # Os filtros viram uma única máscara; só as linhas selecionadas são copiadas
+            df_base = st.session_state.df_final
+            cargos = sorted(df_base['cargo_pt_team'].dropna().unique())
             cargo_selected = st.selectbox("Position", options=["All"] + cargos)
             status_selected = st.selectbox("Status", options=["All", "OK", "Retreinamento", "Not started"])
             data_inicial = st.date_input("Start Date")
             data_final = st.date_input("End Date")
             
+            mascara = pd.Series(True, index=df_base.index)
             if cargo_selected != "All":
-                df_final = df_final[df_final['cargo_pt_team'] == cargo_selected]
+                mascara &= df_base['cargo_pt_team'] == cargo_selected
             if status_selected != "All":
-                df_final = df_final[df_final['status_final'] == status_selected]
-            if 'control_data_completo' in df_final.columns:
-                df_final['control_data_completo'] = pd.to_datetime(df_final['control_data_completo'], errors='coerce')
-                df_final = df_final[(df_final['control_data_completo'] >= pd.to_datetime(data_inicial)) & 
-                                    (df_final['control_data_completo'] <= pd.to_datetime(data_final))]
+                mascara &= df_base['status_final'] == status_selected
+            if 'control_data_completo' in df_base.columns:
+                datas = pd.to_datetime(df_base['control_data_completo'], errors='coerce')
+                mascara &= (datas >= pd.to_datetime(data_inicial)) & (datas <= pd.to_datetime(data_final))
+            df_final = df_base[mascara]
             
             if df_final.empty:
                 st.info("No records found with the applied filters.")
             else:
                 st.dataframe(df_final)
-                buffer = io.BytesIO()
-                df_final.to_excel(buffer, index=False)
-                st.download_button(label="Export Filtered Data",
-                                   data=buffer,
-                                   file_name=f"Training_Status_Filtered_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-                                   mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                versao = st.session_state.get('df_final_version') or dataset_version(df_base)
+                export_download_button("Export Filtered Data", df_final, versao,
+                                       f"Training_Status_Filtered_{datetime.now().strftime('%Y-%m-%d')}",
+                                       key="export_filtered",
+                                       filter_state=[cargo_selected, status_selected, data_inicial, data_final])
     
     # ----- Aba Visualization -----
     with tabs[2]:
@@ -545,22 +526,20 @@ if st.session_state.get('logged_in'):
             st.error("No processed data available for visualization. Go to the 'Report' tab.")
         else:
             df_final = st.session_state.df_final
+            rollups = build_report_rollups(df_final, st.session_state.get('df_final_version') or dataset_version(df_final))
             # Pie Chart – Overall Status
-            status_counts = df_final['status_final'].value_counts()
-            labels = ['OK', 'Retreinamento', 'Not started']
-            data = [status_counts.get(l, 0) for l in labels]
-            fig1, ax1 = plt.subplots()
-            ax1.pie(data, labels=labels, autopct='%1.1f%%', startangle=90)
-            ax1.axis('equal')
-            st.pyplot(fig1)
+            labels = STATUS_LABELS
+            data = [rollups["status_counts"][l] for l in labels]
+            st.image(chart_status_pie(tuple(labels), tuple(data)))
             
             # Bar Chart – Status by Position
-            if 'cargo_pt_team' in df_final.columns and 'status_final' in df_final.columns:
-                group = df_final.groupby(['cargo_pt_team', 'status_final']).size().unstack(fill_value=0)
-                fig2, ax2 = plt.subplots(figsize=(8, 4))
-                group.plot(kind='bar', ax=ax2)
-                ax2.set_title("Status by Position")
-                st.pyplot(fig2)
+            group = rollups["status_by_position"]
+            if group is not None:
+                if len(group) > CHART_MAX_STATIC_POSITIONS:
+                    st.markdown("**Status by Position**")
+                    st.bar_chart(group, horizontal=True)
+                else:
+                    st.image(chart_status_by_position(group))
     
     # ----- Aba Full Table -----
     with tabs[3]:
@@ -568,77 +547,54 @@ if st.session_state.get('logged_in'):
         if st.session_state.get('df_final') is None:
             st.error("No processed data available. Go to the 'Report' tab and process the data.")
         else:
-            df_table = st.session_state.df_final.copy()
+            df_table = st.session_state.df_final
+            versao = st.session_state.get('df_final_version') or dataset_version(df_table)
             st.markdown("### Global Filter (search all columns)")
             search_term = st.text_input("Enter search term:")
             if search_term:
-                df_table = df_table[df_table.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)]
+                df_table = search_dataframe(df_table, search_term, versao)
             st.dataframe(df_table)
-            buffer = io.BytesIO()
-            df_table.to_excel(buffer, index=False)
-            st.download_button(label="Export Customized Data",
-                               data=buffer,
-                               file_name=f"Training_Status_Custom_{datetime.now().strftime('%Y-%m-%d')}.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            export_download_button("Export Customized Data", df_table, versao,
+                                   f"Training_Status_Custom_{datetime.now().strftime('%Y-%m-%d')}",
+                                   key="export_full_table", filter_state=search_term)
     
     # ----- Aba Saved Uploads -----
     with tabs[4]:
         st.header("Saved Uploads")
-        upload_dir = "uploaded_files"
-        if not os.path.exists(upload_dir):
-            st.error("No saved uploads found.")
+        saved_sessions = {sessao["folder"]: sessao for sessao in get_upload_sessions(with_report=True)}
+        if not saved_sessions:
+            st.info("No uploads with processed reports found.")
         else:
-            session_folders = [os.path.join(upload_dir, d) for d in os.listdir(upload_dir)
-                               if os.path.isdir(os.path.join(upload_dir, d)) and os.path.exists(os.path.join(upload_dir, d, "final.xlsx"))]
-            if not session_folders:
-                st.info("No uploads with processed reports found.")
-            else:
-                sessions_dict = {}
-                for folder in session_folders:
-                    session_name = os.path.basename(folder)
-                    try:
-                        session_date = datetime.strptime(session_name, "%Y%m%d%H%M%S")
-                        sessions_dict[folder] = session_date.strftime("%Y-%m-%d %H:%M:%S")
-                    except Exception:
-                        sessions_dict[folder] = "Unknown Date"
-                
-                selected_session = st.selectbox("Select an upload", list(sessions_dict.keys()), format_func=lambda x: sessions_dict[x])
-                if selected_session:
-                    final_file = os.path.join(selected_session, "final.xlsx")
-                    if os.path.exists(final_file):
-                        df_saved = pd.read_excel(final_file)
-                        st.dataframe(df_saved)
-                        buffer = io.BytesIO()
-                        df_saved.to_excel(buffer, index=False)
-                        st.download_button(label="Export Selected Upload Data",
-                                           data=buffer,
-                                           file_name=f"Report_{os.path.basename(selected_session)}.xlsx",
-                                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-                    else:
-                        st.error("final.xlsx file not found in the selected upload.")
+            selected_session = st.selectbox("Select an upload", list(saved_sessions.keys()),
+                                            format_func=lambda x: describe_upload_session(saved_sessions[x]))
+            if selected_session:
+                sessao = saved_sessions[selected_session]
+                manifest = session_report_manifest(sessao)
+                if os.path.exists(manifest["xlsx"]):
+                    if sessao["status_summary"]:
+                        st.caption(" · ".join(f"{status}: {total}" for status, total in sessao["status_summary"].items()))
+                    df_preview = read_report_preview(manifest)
+                    st.caption(f"Previewing the first {len(df_preview)} of {sessao['row_count']} rows.")
+                    st.dataframe(df_preview)
+                    export_download_button("Export Selected Upload Data", lambda: read_report(manifest), manifest["version"],
+                                           f"Report_{os.path.basename(selected_session)}",
+                                           key="export_saved_upload", xlsx_file=manifest["xlsx"])
+                else:
+                    st.error("Final report not found in the selected upload.")
     
 # ----- Aba VCP -----
 vcp_index = tabs_list.index("VCP")
 with tabs[vcp_index]:
     st.header("R & VCP Tracking")
     
-    # --- Carregamento/Persistência da Tabela VCP ---
-    colunas_padrao = [
-        "Employee", "Position (English)", "Procedure Number Assigned", 
-        "Procedure Number Alternative", "Date Completed", 
-        "Due Date", "Status VCP", "Reading", "Upload"
-    ]
-    if "vcp_data" not in st.session_state:
-        if os.path.exists("vcp_data.csv"):
-            st.session_state.vcp_data = pd.read_csv("vcp_data.csv")
-        else:
-            st.session_state.vcp_data = pd.DataFrame(columns=colunas_padrao)
+    # --- Carregamento da Tabela VCP (lida do banco a cada execução) ---
+    vcp_data = load_vcp_data()
+    if "vcp_editor_rev" not in st.session_state:
+        st.session_state.vcp_editor_rev = 0
     
     # --- Overview no Topo ---
-    if not st.session_state.vcp_data.empty:
-        total = len(st.session_state.vcp_data)
-        ok_count = (st.session_state.vcp_data["Status VCP"] == "OK").sum()
-        overdue_count = (st.session_state.vcp_data["Status VCP"] == "Overdue").sum()
+    total, ok_count, overdue_count = get_vcp_overview()
+    if total > 0:
         perc_ok = (ok_count / total * 100) if total > 0 else 0
         perc_overdue = (overdue_count / total * 100) if total > 0 else 0
         col1, col2, col3 = st.columns(3)
@@ -655,62 +611,41 @@ with tabs[vcp_index]:
     def filter_global(df, search_term):
         if search_term == "":
             return df
-        return df[df.apply(lambda row: row.astype(str).str.contains(search_term, case=False).any(), axis=1)]
+        return search_dataframe(df, search_term, dataset_version(df))
     
-    df_filtered = filter_global(st.session_state.vcp_data, global_filter)
+    df_filtered = filter_global(vcp_data, global_filter)
     
     st.markdown("### Tabela VCP (Edite as informações conforme necessário)")
-    edited_df = st.data_editor(df_filtered, num_rows="dynamic", use_container_width=True, key="vcp_table_edit")
-    
-    # Botão para salvar alterações com re-cálculo dos campos
-    def calc_due_date(date_input):
-        try:
-            if pd.isna(date_input) or str(date_input).strip() == "":
-                return ""
-            dt = pd.to_datetime(date_input, format="%Y-%m-%d", errors="coerce")
-            if pd.isna(dt):
-                return ""
-            due = dt + pd.Timedelta(days=730)
-            return due.strftime("%Y-%m-%d")
-        except Exception:
-            return ""
-    
-    def status_vcp(due_date_str):
-        try:
-            if due_date_str == "":
-                return "Overdue"
-            due_date = datetime.strptime(due_date_str, "%Y-%m-%d").date()
-            today = datetime.today().date()
-            return "OK" if due_date >= today else "Overdue"
-        except Exception:
-            return "Overdue"
+    editor_key = f"vcp_table_edit_{st.session_state.vcp_editor_rev}"
+    edited_df = st.data_editor(df_filtered, num_rows="dynamic", use_container_width=True, key=editor_key)
     
+    # Salva só o que o editor reporta como alterado: linhas editadas/novas são recalculadas e
+    # gravadas registro a registro; as demais (inclusive as ocultas pelo filtro) ficam intactas
     if st.button("Salvar Alterações na Tabela VCP"):
-        edited_df["Due Date"] = edited_df["Date Completed"].apply(lambda x: calc_due_date(x))
-        edited_df["Status VCP"] = edited_df["Due Date"].apply(lambda d: status_vcp(d))
-        edited_df["Reading"] = edited_df["Status VCP"].apply(lambda s: "Completed" if s=="OK" else "Pending")
-        st.session_state.vcp_data = edited_df.copy()
-        edited_df.to_csv("vcp_data.csv", index=False)
-        st.success("Tabela VCP atualizada e salva!")
-    
-    # --- Botão para Download em Excel ---
-    @st.cache_data(show_spinner=False)
-    def convert_df_to_excel(df):
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='VCP')
-        return output.getvalue()
+        estado_editor = st.session_state.get(editor_key, {})
+        apagadas = df_filtered.index[sorted(estado_editor.get("deleted_rows", []))]
+        posicoes_editadas = sorted(int(p) for p in estado_editor.get("edited_rows", {}))
+        editadas = edited_df.loc[df_filtered.index[posicoes_editadas].difference(apagadas)]
+        n_novas = len(estado_editor.get("added_rows", []))
+        novas = edited_df.iloc[len(edited_df) - n_novas:] if n_novas else edited_df.iloc[0:0]
+        
+        if editadas.empty and novas.empty and apagadas.empty:
+            st.info("Nenhuma alteração para salvar.")
+        else:
+            try:
+                save_vcp_changes(recalc_vcp(editadas), recalc_vcp(novas), apagadas)
+                st.session_state.vcp_editor_rev += 1
+                vcp_data = load_vcp_data()
+                st.success("Tabela VCP atualizada e salva!")
+            except sqlite3.IntegrityError:
+                st.error("Já existe um registro com este Employee e Procedure Number Assigned.")
     
-    excel_data = convert_df_to_excel(st.session_state.vcp_data)
-    st.download_button(
-        label="Baixar Tabela VCP em Excel",
-        data=excel_data,
-        file_name="vcp_table.xlsx",
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    )
+    # --- Botão para Download ---
+    export_download_button("Baixar Tabela VCP", vcp_data, dataset_version(vcp_data), "vcp_table",
+                           key="export_vcp", sheet_name="VCP")
     
     st.markdown("### Tabela VCP Atualizada")
-    st.dataframe(st.session_state.vcp_data, use_container_width=True, height=500)
+    st.dataframe(vcp_data, use_container_width=True, height=500)
     
     # --- Seção de Importação e Upload no Final da Página ---
     st.markdown("---")
@@ -720,31 +655,30 @@ with tabs[vcp_index]:
         type=["xlsx"],
         key="vcp_table_upload_bottom"
     )
-    if uploaded_vcp_file is not None:
+    # O arquivo continua no uploader entre execuções: importa uma única vez por arquivo enviado
+    if uploaded_vcp_file is not None and st.session_state.get("vcp_imported_file") != uploaded_vcp_file.file_id:
         try:
             df_uploaded = pd.read_excel(uploaded_vcp_file, usecols="A:E")
             for col in ["Date Completed", "Due Date", "Status VCP", "Reading", "Upload"]:
                 if col not in df_uploaded.columns:
                     df_uploaded[col] = ""
-            st.session_state.vcp_data = df_uploaded.copy()
-            df_uploaded.to_csv("vcp_data.csv", index=False)
+            save_vcp_data(df_uploaded)
+            st.session_state.vcp_imported_file = uploaded_vcp_file.file_id
+            vcp_data = load_vcp_data()
             st.success("Nova tabela VCP importada e salva com sucesso!")
         except Exception as e:
             st.error(f"Ocorreu um erro ao ler o arquivo: {e}")
     
     st.markdown("## Upload de Arquivo para Funcionário")
-    if "Employee" in st.session_state.vcp_data.columns and not st.session_state.vcp_data.empty:
-        selected_employee = st.selectbox("Selecione o Employee", st.session_state.vcp_data["Employee"].unique(), key="vcp_employee_bottom")
+    if not vcp_data.empty:
+        selected_employee = st.selectbox("Selecione o Employee", vcp_data["Employee"].unique(), key="vcp_employee_bottom")
     else:
         selected_employee = None
     
     uploaded_file = st.file_uploader("Arraste o arquivo aqui", type=["pdf", "docx", "xlsx"], key="vcp_upload_bottom")
     if uploaded_file is not None and selected_employee is not None:
-        idx = st.session_state.vcp_data.index[st.session_state.vcp_data["Employee"] == selected_employee].tolist()
-        if idx:
-            st.session_state.vcp_data.at[idx[0], "Upload"] = uploaded_file.name
-            st.success(f"Arquivo '{uploaded_file.name}' enviado para {selected_employee}.")
-            st.session_state.vcp_data.to_csv("vcp_data.csv", index=False)
+        set_vcp_upload(selected_employee, uploaded_file.name)
+        st.success(f"Arquivo '{uploaded_file.name}' enviado para {selected_employee}.")
 
     
     # ----- Aba Admin (somente para usuário admin) -----
@@ -774,19 +708,59 @@ with tabs[vcp_index]:
                 else:
                     delete_user(user_to_delete)
                     st.success(f"User '{user_to_delete}' deleted successfully!")
-                    st.experimental_rerun()
+                    st.rerun()
+            
+            st.subheader("Upload Storage")
+            st.caption("Uploaded workbooks are stored once per content and shared between sessions.")
+            if st.button("Remove unreferenced uploads"):
+                removidos, liberados = collect_garbage_blobs()
+                st.success(f"{removidos} stored files removed ({liberados / (1024 * 1024):.1f} MB freed).")
+            
+            st.subheader("Performance")
+            show_performance_panel()
     
     # ----- Aba History -----
     with tabs[-2] if st.session_state.username.lower() == "admin" else tabs[5]:
         st.header("Reports History")
         try:
-            conn = sqlite3.connect(DB_PATH)
-            df_history = pd.read_sql_query("SELECT * FROM report_history ORDER BY id DESC", conn)
-            conn.close()
+            usuarios_hist, tipos_hist = get_report_history_filters()
+            col_user, col_tipo = st.columns(2)
+            hist_user = col_user.selectbox("User", ["All"] + usuarios_hist, key="hist_user")
+            hist_tipo = col_tipo.selectbox("Report type", ["All"] + tipos_hist, key="hist_type")
+            hist_inicio = hist_fim = None
+            if st.checkbox("Filter by date", key="hist_by_date"):
+                col_inicio, col_fim = st.columns(2)
+                hist_inicio = col_inicio.date_input("From", key="hist_from")
+                hist_fim = col_fim.date_input("To", key="hist_to")
+            filtros_hist = dict(start_date=hist_inicio, end_date=hist_fim,
+                                user=None if hist_user == "All" else hist_user,
+                                report_type=None if hist_tipo == "All" else hist_tipo)
+
+            # Pilha com o cursor (id) de início de cada página; volta à primeira página quando os filtros mudam
+            if st.session_state.get("hist_filters") != filtros_hist:
+                st.session_state.hist_filters = filtros_hist
+                st.session_state.hist_cursors = [None]
+            cursores = st.session_state.hist_cursors
+            df_history, ha_mais = get_report_history_page(before_id=cursores[-1], **filtros_hist)
+
             if df_history.empty:
                 st.info("No report logs found.")
             else:
                 st.dataframe(df_history)
+            col_anterior, col_pagina, col_proxima = st.columns(3)
+            col_pagina.write(f"Page {len(cursores)}")
+            col_anterior.button("Previous page", disabled=len(cursores) == 1, key="hist_prev",
+                                on_click=cursores.pop)
+            col_proxima.button("Next page", disabled=not ha_mais, key="hist_next",
+                               on_click=cursores.append, args=(int(df_history['id'].iloc[-1]) if ha_mais else None,))
+
+            if st.session_state.username.lower() == "admin":
+                st.subheader("Retention")
+                dias_retencao = st.number_input("Keep entries from the last N days", min_value=1, value=HISTORY_RETENTION_DAYS, key="hist_retention")
+                if st.button("Archive older entries", key="hist_archive"):
+                    movidos = archive_report_history(dias_retencao)
+                    st.session_state.hist_cursors = [None]
+                    st.success(f"{movidos} entries moved to the compressed archive.")
         except Exception as e:
             st.error(f"Error loading history: {e}")
 
@@ -797,92 +771,33 @@ with tabs[1]:
     if 'df_final' not in st.session_state or st.session_state.df_final is None:
         st.info("Nenhum dado processado encontrado. Por favor, gere o relatório na aba 'Report'.")
     else:
-        df_final = st.session_state.df_final.copy()
+        df_final = st.session_state.df_final
+        rollups = build_report_rollups(df_final, st.session_state.get('df_final_version') or dataset_version(df_final))
+        mensal = rollups["monthly"]
         
-        # Converte a coluna de data de conclusão para datetime (se já não estiver)
-        if "control_data_completo" in df_final.columns:
-            df_final['control_data_completo'] = pd.to_datetime(df_final['control_data_completo'], errors='coerce')
-            df_final = df_final.dropna(subset=['control_data_completo'])
-        else:
+        if mensal is None:
             st.error("Coluna 'control_data_completo' não encontrada.")
-        
-        # Filtra os treinamentos concluídos, considerando status_final == "OK"
-        df_concluidos = df_final[df_final['status_final'].str.upper() == "OK"].copy()
-        
-        # Define o agrupamento por mês/ano diretamente a partir da coluna de data
-        total_por_mes = (
-            df_final.groupby(df_final['control_data_completo'].dt.to_period('M'))
-            .size()
-            .reset_index(name="planejado")
-        )
-        # Converte o período para string para exibição
-        total_por_mes['mes_ano'] = total_por_mes['control_data_completo'].astype(str)
-        
-        concluidos_por_mes = (
-            df_concluidos.groupby(df_concluidos['control_data_completo'].dt.to_period('M'))
-            .size()
-            .reset_index(name="concluidos")
-        )
-        concluidos_por_mes['mes_ano'] = concluidos_por_mes['control_data_completo'].astype(str)
-        
-        # Mescla os resultados por período
-        overview = pd.merge(
-            total_por_mes[['mes_ano', 'planejado']],
-            concluidos_por_mes[['mes_ano', 'concluidos']],
-            on="mes_ano",
-            how="left"
-        )
-        overview['concluidos'] = overview['concluidos'].fillna(0)
-        overview['percentual'] = (overview['concluidos'] / overview['planejado']) * 100
-        
-        st.subheader("Overview Mensal de Conclusão")
-        st.dataframe(overview)
-        
-        # Gráfico de linha – Evolução Mensal do Percentual de Conclusão
-        fig, ax = plt.subplots(figsize=(10, 5))
-        ax.plot(overview['mes_ano'], overview['percentual'], marker='o')
-        ax.set_xlabel("Mês/Ano")
-        ax.set_ylabel("Percentual de Conclusão (%)")
-        ax.set_title("Evolução Mensal dos Treinamentos Concluídos")
-        plt.xticks(rotation=45)
-        st.pyplot(fig)
-        
-        # Separando os treinamentos em "R" e "R & VCP"
-        df_concluidos['training_type'] = df_concluidos['procedimento_nome'].apply(
-            lambda x: "R & VCP" if pd.notnull(x) and "vcp" in str(x).lower() else "R"
-        )
-        
-        st.subheader("Treinamentos Concluídos por Mês e Tipo")
-        resumo_mes = (
-            df_concluidos.groupby([df_concluidos['control_data_completo'].dt.to_period('M'), 'training_type'])
-            .size()
-            .reset_index(name="completos")
-        )
-        resumo_mes['mes_ano'] = resumo_mes['control_data_completo'].astype(str)
-        st.dataframe(resumo_mes)
-        
-        # Gráfico de barras – Treinamentos por tipo
-        fig2, ax2 = plt.subplots(figsize=(10, 5))
-        for t in df_concluidos['training_type'].unique():
-            dados = resumo_mes[resumo_mes['training_type'] == t]
-            ax2.bar(dados['mes_ano'], dados['completos'], label=t)
-        ax2.set_xlabel("Mês/Ano")
-        ax2.set_ylabel("Número de Treinamentos Concluídos")
-        ax2.set_title("Treinamentos Concluídos por Mês e Tipo")
-        ax2.legend()
-        plt.xticks(rotation=45)
-        st.pyplot(fig2)
-        
-        # Overview específico para treinamentos com VCP
-        df_vcp = df_concluidos[df_concluidos['training_type'] == "R & VCP"]
-        total_vcp_planejado = df_final[
-            df_final['procedimento_nome'].apply(lambda x: pd.notnull(x) and "vcp" in str(x).lower())
-        ].shape[0]
-        total_vcp_concluidos = df_vcp.shape[0]
-        percentual_vcp = (total_vcp_concluidos / total_vcp_planejado) * 100 if total_vcp_planejado > 0 else 0
-        
-        st.subheader("Overview de Treinamentos com VCP")
-        st.write(f"**Treinamentos (com VCP) Planejados:** {total_vcp_planejado}")
-        st.write(f"**Treinamentos com VCP Concluídos:** {total_vcp_concluidos}")
-        st.write(f"**Percentual de Conclusão dos VCPs:** {percentual_vcp:.2f}%")
-
+        else:
+            overview = mensal["overview"]
+            st.subheader("Overview Mensal de Conclusão")
+            st.dataframe(overview)
+            
+            # Gráfico de linha – Evolução Mensal do Percentual de Conclusão
+            st.image(chart_monthly_completion(overview))
+            
+            st.subheader("Treinamentos Concluídos por Mês e Tipo")
+            resumo_mes = mensal["by_type"]
+            st.dataframe(resumo_mes)
+            
+            # Gráfico de barras – Treinamentos por tipo
+            st.image(chart_completed_by_type(resumo_mes, tuple(mensal["training_types"])))
+            
+            # Overview específico para treinamentos com VCP
+            total_vcp_planejado = mensal["vcp_planned"]
+            total_vcp_concluidos = mensal["vcp_completed"]
+            percentual_vcp = (total_vcp_concluidos / total_vcp_planejado) * 100 if total_vcp_planejado > 0 else 0
+            
+            st.subheader("Overview de Treinamentos com VCP")
+            st.write(f"**Treinamentos (com VCP) Planejados:** {total_vcp_planejado}")
+            st.write(f"**Treinamentos com VCP Concluídos:** {total_vcp_concluidos}")
+            st.write(f"**Percentual de Conclusão dos VCPs:** {percentual_vcp:.2f}%")
@@ -0,0 +1,2148 @@
+"""Motor do Training Report: ingestão, pipeline, artefatos, catálogo e fila de e-mail.
+
+Não depende do Streamlit: é importado pela interface (training.py) e também roda em lote
+pela linha de comando, por exemplo num cron noturno:
+
+    python training_engine.py uploaded_files --latest
+    python training_engine.py uploaded_files/20250101120000 --parallel 2
+    python training_engine.py /dados/fpso_a /dados/fpso_b --skip-processed --no-email
+    python training_engine.py --archive-history 365
+
+Execute a partir da pasta da aplicação (ou use --root): o banco, uploaded_files e o
+repositório de blobs usam caminhos relativos, os mesmos da interface.
+"""
+import argparse
+import cProfile
+import logging
+import pstats
+import sqlite3
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta
+import io
+import re
+import unicodedata
+import os
+import hashlib
+import json
+import zlib
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import xlsxwriter
+from rapidfuzz import fuzz, process
+
+# Módulos para envio de e-mail
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+
+logger = logging.getLogger(__name__)
+
+# ========================
+# Email Settings (ajuste conforme necessário)
+# ========================
+SMTP_SERVER = "smtp.gmail.com"
+SMTP_PORT = 587
+SMTP_USERNAME = "seuemail@gmail.com"      # Altere para o seu e-mail
+SMTP_PASSWORD = "suasenha"                  # Altere para sua senha (ou app password)
+EMAIL_RECIPIENT = "destinatario@exemplo.com"  # E-mail do destinatário
+
+SMTP_USE_TLS = True                          # Desative para testar com um servidor SMTP local (ex.: aiosmtpd)
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 30                 # Espera antes da 2ª tentativa; dobra a cada nova falha
+EMAIL_POLL_SECONDS = 10
+SMTP_IDLE_SECONDS = 60                        # Fecha a conexão SMTP após esse tempo sem envios
+EMAIL_WORKER_MAX_BACKOFF_SECONDS = 300        # Espera máxima do worker após erros seguidos (ex.: banco travado)
+
+def build_email_message(subject, body, to_email, attachment_path=None):
+    msg = MIMEMultipart()
+    msg['From'] = SMTP_USERNAME
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain'))
+    
+    # Anexa o arquivo, se houver
+    if attachment_path and os.path.exists(attachment_path):
+        with open(attachment_path, "rb") as f:
+            part = MIMEApplication(f.read(), Name=os.path.basename(attachment_path))
+        part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment_path)}"'
+        msg.attach(part)
+    return msg
+
+class SmtpConnection:
+    """Conexão SMTP autenticada reaproveitada entre envios, reaberta quando cai ou fica ociosa."""
+
+    def __init__(self):
+        self._server = None
+        self._ultimo_uso = 0.0
+
+    def _conectar(self):
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+        if SMTP_USE_TLS:
+            server.starttls()
+        if SMTP_USERNAME and SMTP_PASSWORD:
+            server.login(SMTP_USERNAME, SMTP_PASSWORD)
+        return server
+
+    def send(self, msg):
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] != 250:
+                    self.close()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+        if self._server is None:
+            self._server = self._conectar()
+        self._server.send_message(msg)
+        self._ultimo_uso = time.monotonic()
+
+    def close_if_idle(self, idle_seconds=SMTP_IDLE_SECONDS):
+        if self._server is not None and time.monotonic() - self._ultimo_uso > idle_seconds:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+class EmailWorker(threading.Thread):
+    """Thread que esvazia a fila email_outbox, com novas tentativas e espera exponencial."""
+
+    def __init__(self, pool, smtp=None):
+        super().__init__(name="email-outbox-worker", daemon=True)
+        self.pool = pool
+        self.smtp = smtp or SmtpConnection()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+
+    def wake(self):
+        self._acordar.set()
+
+    def stop(self):
+        self._parar.set()
+        self._acordar.set()
+
+    def run(self):
+        recuperar, falhas = True, 0
+        while not self._parar.is_set():
+            try:
+                if recuperar:
+                    # E-mails que ficaram "sending" por uma queda do processo (ou um erro abaixo) voltam para a fila
+                    with self.pool.connection() as conn:
+                        conn.execute("UPDATE email_outbox SET status = 'pending' WHERE status = 'sending'")
+                    recuperar = False
+                processados = self.drain()
+                falhas = 0
+            except Exception:
+                # Um erro do banco (ex.: "database is locked" além do busy timeout) não pode encerrar a thread
+                falhas += 1
+                espera = min(EMAIL_POLL_SECONDS * 2 ** (falhas - 1), EMAIL_WORKER_MAX_BACKOFF_SECONDS)
+                logger.exception("E-mail worker error; retrying in %s s", espera)
+                self.smtp.close()
+                recuperar = True
+                self._parar.wait(espera)
+                continue
+            if processados == 0:
+                self.smtp.close_if_idle()
+                self._acordar.wait(EMAIL_POLL_SECONDS)
+                self._acordar.clear()
+        self.smtp.close()
+
+    def drain(self, limit=20):
+        """Envia os e-mails pendentes cuja próxima tentativa já venceu; retorna quantos foram processados."""
+        agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.pool.connection() as conn:
+            pendentes = conn.execute("""
+                SELECT id, subject, body, to_email, attachment_path, attempts FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?
+            """, (agora, limit)).fetchall()
+        processados = 0
+        for email_id, subject, body, to_email, attachment_path, attempts in pendentes:
+            with self.pool.connection() as conn:
+                reservado = conn.execute("UPDATE email_outbox SET status = 'sending' WHERE id = ? AND status = 'pending'",
+                                         (email_id,)).rowcount
+            if not reservado:
+                continue
+            processados += 1
+            try:
+                self.smtp.send(build_email_message(subject, body, to_email, attachment_path))
+            except Exception as e:
+                self.smtp.close()
+                attempts += 1
+                espera = EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+                proxima = (datetime.now() + timedelta(seconds=espera)).strftime("%Y-%m-%d %H:%M:%S")
+                status = "failed" if attempts >= EMAIL_MAX_ATTEMPTS else "pending"
+                with self.pool.connection() as conn:
+                    conn.execute("""
+                        UPDATE email_outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                        WHERE id = ?
+                    """, (status, attempts, proxima, str(e), email_id))
+            else:
+                with self.pool.connection() as conn:
+                    conn.execute("UPDATE email_outbox SET status = 'sent', attempts = ?, sent_at = ?, last_error = NULL WHERE id = ?",
+                                 (attempts + 1, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), email_id))
+        return processados
+
+_email_worker = None
+_email_worker_lock = threading.Lock()
+
+def get_email_worker():
+    """Worker de e-mail do processo, iniciado uma única vez (e de novo, se a thread tiver terminado)."""
+    global _email_worker
+    with _email_worker_lock:
+        if _email_worker is None or not _email_worker.is_alive():
+            _email_worker = EmailWorker(get_db())
+            _email_worker.start()
+        return _email_worker
+
+def queue_email(subject, body, to_email, attachment_path=None):
+    """Grava o e-mail na fila durável (email_outbox) e acorda o worker; o envio acontece em segundo plano.
+
+    Sem worker no processo (execução em lote), o e-mail fica na fila até um drain() ou o próximo worker.
+    """
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with get_db().connection() as conn:
+        conn.execute("""
+            INSERT INTO email_outbox (created_at, subject, body, to_email, attachment_path, status, attempts, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, 'pending', 0, ?)
+        """, (agora, subject, body, to_email, attachment_path, agora))
+    if _email_worker is not None:
+        _email_worker.wake()
+
+# ========================
+# Database Configuration
+# ========================
+DB_PATH = "report_history.db"
+DB_BUSY_TIMEOUT_MS = 5000
+DB_POOL_SIZE = 8
+
+class ConnectionPool:
+    """Pool de conexões SQLite compartilhado entre as sessões (WAL + busy timeout)."""
+
+    def __init__(self, path, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._livres = queue.LifoQueue()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Empresta uma conexão; faz commit ao final do bloco (ou rollback em caso de erro)."""
+        try:
+            conn = self._livres.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            with conn:
+                yield conn
+        finally:
+            if self._livres.qsize() < self.size:
+                self._livres.put(conn)
+            else:
+                conn.close()
+
+def _migration_initial_schema(conn):
+    # Cria tabela report_history, se não existir
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS report_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT,
+        report_type TEXT,
+        file_name TEXT,
+        filter_options TEXT,
+        user TEXT
+    )
+    """)
+    # Cria tabela users, se não existir (apenas com o usuário admin)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password TEXT
+    )
+    """)
+    # Verifica se a coluna last_access existe na tabela users e adiciona se não existir
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if "last_access" not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN last_access TEXT")
+    
+    # Insere somente o usuário admin (sem outros usuários)
+    conn.execute("INSERT OR IGNORE INTO users (username, password, last_access) VALUES (?, ?, ?)", ("admin", "1234", None))
+
+def _migration_history_indexes(conn):
+    # Índices para filtros e paginação por chave do histórico, e tabela de arquivo compactado
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_report_history_timestamp ON report_history (timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_report_history_user ON report_history (user, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_report_history_type ON report_history (report_type, id)")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS report_history_archive (
+        period TEXT PRIMARY KEY,
+        row_count INTEGER,
+        payload BLOB,
+        archived_at TEXT
+    )
+    """)
+
+def _migration_email_outbox(conn):
+    # Fila de e-mails enviada em segundo plano pelo EmailWorker
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS email_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_at TEXT,
+        subject TEXT,
+        body TEXT,
+        to_email TEXT,
+        attachment_path TEXT,
+        status TEXT,
+        attempts INTEGER,
+        next_attempt_at TEXT,
+        last_error TEXT,
+        sent_at TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_status ON email_outbox (status, next_attempt_at)")
+
+def _migration_upload_sessions(conn):
+    # Catálogo das sessões em uploaded_files (preenchido por sync_upload_catalog para as já existentes)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        folder TEXT PRIMARY KEY,
+        created_at TEXT,
+        username TEXT,
+        status TEXT,
+        file_hashes TEXT,
+        row_count INTEGER,
+        status_summary TEXT,
+        report_version TEXT,
+        report_xlsx TEXT,
+        report_parquet TEXT,
+        updated_at TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_upload_sessions_created_at ON upload_sessions (created_at)")
+
+def _migration_vcp_records(conn):
+    # Tabela VCP (antes em vcp_data.csv), com os dados do arquivo antigo importados
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS vcp_records (
+        employee TEXT NOT NULL,
+        position TEXT,
+        procedure TEXT NOT NULL,
+        procedure_alternative TEXT,
+        date_completed TEXT,
+        due_date TEXT,
+        status_vcp TEXT,
+        reading TEXT,
+        upload TEXT,
+        updated_at TEXT,
+        PRIMARY KEY (employee, procedure)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_vcp_records_status ON vcp_records (status_vcp)")
+    import_legacy_vcp(conn)
+
+def _migration_report_metrics(conn):
+    # Tempo, linhas e memória de cada processamento (ligados ao report_history quando há registro no histórico)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS report_metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        history_id INTEGER,
+        recorded_at TEXT,
+        user TEXT,
+        session_folder TEXT,
+        row_count INTEGER,
+        total_seconds REAL,
+        peak_rss_mb REAL,
+        stages TEXT,
+        profile BLOB
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_report_metrics_recorded_at ON report_metrics (recorded_at)")
+
+# Migrações do schema, aplicadas em ordem; PRAGMA user_version guarda quantas já rodaram
+SCHEMA_MIGRATIONS = [
+    _migration_initial_schema,
+    _migration_history_indexes,
+    _migration_email_outbox,
+    _migration_upload_sessions,
+    _migration_vcp_records,
+    _migration_report_metrics,
+]
+
+def init_db(pool):
+    """Aplica as migrações pendentes do schema."""
+    with pool.connection() as conn:
+        versao = conn.execute("PRAGMA user_version").fetchone()[0]
+        for numero, migracao in enumerate(SCHEMA_MIGRATIONS[versao:], start=versao + 1):
+            migracao(conn)
+            conn.execute(f"PRAGMA user_version = {numero}")
+
+_db_pool = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """Pool de conexões do processo, criado (e com o schema migrado) uma única vez."""
+    global _db_pool
+    with _db_lock:
+        if _db_pool is None:
+            pool = ConnectionPool(DB_PATH)
+            init_db(pool)
+            _db_pool = pool
+        return _db_pool
+
+def update_last_access(username):
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with get_db().connection() as conn:
+        conn.execute("UPDATE users SET last_access = ? WHERE username = ?", (timestamp, username))
+
+def check_login(username, password):
+    with get_db().connection() as conn:
+        return conn.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, password)).fetchone()
+
+def log_report(report_type, file_name, filter_options="", user="Unknown"):
+    """Registra o relatório no histórico; retorna o id do registro."""
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with get_db().connection() as conn:
+        return conn.execute("""
+            INSERT INTO report_history (timestamp, report_type, file_name, filter_options, user)
+            VALUES (?, ?, ?, ?, ?)
+        """, (timestamp, report_type, file_name, filter_options, user)).lastrowid
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_RETENTION_DAYS = 365
+
+def get_report_history_page(before_id=None, start_date=None, end_date=None, user=None, report_type=None,
+                            page_size=HISTORY_PAGE_SIZE):
+    """Uma página do histórico, do mais recente para o mais antigo, paginada por chave (id < before_id).
+
+    Retorna (df_pagina, ha_mais_paginas).
+    """
+    condicoes, params = [], []
+    if before_id is not None:
+        condicoes.append("id < ?")
+        params.append(before_id)
+    if start_date is not None:
+        condicoes.append("timestamp >= ?")
+        params.append(start_date.strftime("%Y-%m-%d"))
+    if end_date is not None:
+        condicoes.append("timestamp < ?")
+        params.append((end_date + timedelta(days=1)).strftime("%Y-%m-%d"))
+    if user:
+        condicoes.append("user = ?")
+        params.append(user)
+    if report_type:
+        condicoes.append("report_type = ?")
+        params.append(report_type)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    with get_db().connection() as conn:
+        df = pd.read_sql_query(f"SELECT * FROM report_history {where} ORDER BY id DESC LIMIT ?",
+                               conn, params=params + [page_size + 1])
+    return df.head(page_size), len(df) > page_size
+
+def get_report_history_filters():
+    """Usuários e tipos de relatório distintos (lidos pelos índices) para os filtros do histórico."""
+    with get_db().connection() as conn:
+        usuarios = [r[0] for r in conn.execute("SELECT DISTINCT user FROM report_history WHERE user IS NOT NULL ORDER BY user")]
+        tipos = [r[0] for r in conn.execute("SELECT DISTINCT report_type FROM report_history WHERE report_type IS NOT NULL ORDER BY report_type")]
+    return usuarios, tipos
+
+def archive_report_history(retention_days=HISTORY_RETENTION_DAYS):
+    """Move os registros mais antigos que retention_days para report_history_archive.
+
+    Os registros são agrupados por mês (YYYY-MM) e gravados como JSON compactado com zlib;
+    um mês já arquivado é mesclado com os novos registros. As métricas de desempenho do mesmo
+    período são apagadas (não vão para o arquivo). Retorna quantos registros foram movidos.
+    """
+    limite = (datetime.now() - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    movidos = 0
+    with get_db().connection() as conn:
+        def gravar(periodo, linhas):
+            existente = conn.execute("SELECT payload FROM report_history_archive WHERE period = ?", (periodo,)).fetchone()
+            if existente:
+                linhas = json.loads(zlib.decompress(existente[0])) + linhas
+            conn.execute("INSERT OR REPLACE INTO report_history_archive (period, row_count, payload, archived_at) VALUES (?, ?, ?, ?)",
+                         (periodo, len(linhas), zlib.compress(json.dumps(linhas).encode("utf-8")), agora))
+
+        cursor = conn.execute("""
+            SELECT id, timestamp, report_type, file_name, filter_options, user
+            FROM report_history WHERE timestamp < ? ORDER BY timestamp, id
+        """, (limite,))
+        periodo_atual, linhas = None, []
+        for linha in cursor.fetchall():
+            periodo = linha[1][:7]
+            if periodo != periodo_atual and linhas:
+                gravar(periodo_atual, linhas)
+                linhas = []
+            periodo_atual = periodo
+            linhas.append(list(linha))
+            movidos += 1
+        if linhas:
+            gravar(periodo_atual, linhas)
+        conn.execute("DELETE FROM report_history WHERE timestamp < ?", (limite,))
+        conn.execute("DELETE FROM report_metrics WHERE recorded_at < ?", (limite,))
+    return movidos
+
+# ========================
+# Utility Functions
+# ========================
+def safe_float(value):
+    try:
+        return float(str(value).strip())
+    except Exception:
+        return None
+
+def extract_revision(rev_str):
+    if isinstance(rev_str, str):
+        digits = re.sub("[^0-9]", "", rev_str)
+        return int(digits) if digits else None
+    try:
+        return int(rev_str)
+    except Exception:
+        return None
+
+def normalize_text(text):
+    try:
+        text = str(text)
+        text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore').decode('utf-8')
+        return text.lower().strip()
+    except Exception:
+        return str(text).lower().strip()
+
+def normalize_text_series(series):
+    """Versão vetorizada de normalize_text para uma coluna inteira."""
+    return (series.astype("string").str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('utf-8')
+            .str.lower().str.strip())
+
+def extract_revision_series(series):
+    """Versão vetorizada de extract_revision: texto vira os dígitos que contém, números são truncados."""
+    series = series.astype(object)
+    # O acessor .str só aceita colunas com texto; colunas só numéricas (ex.: revisões 3, 4) vão direto para números
+    e_texto = series.map(lambda v: isinstance(v, str)).to_numpy(dtype=bool)
+    revisoes = np.full(len(series), np.nan)
+    digitos = series[e_texto].astype(str).str.replace("[^0-9]", "", regex=True)
+    revisoes[e_texto] = pd.to_numeric(digitos.where(digitos != ""), errors='coerce').to_numpy(dtype=float)
+    numeros = pd.to_numeric(series[~e_texto], errors='coerce').astype(float)
+    revisoes[~e_texto] = np.trunc(numeros.where(np.isfinite(numeros))).to_numpy(dtype=float)
+    return pd.Series(revisoes, index=series.index)
+
+# ========================
+# Funções de Persistência para a Tabela VCP
+# ========================
+VCP_LEGACY_CSV = "vcp_data.csv"
+VCP_LEGACY_DELTA = "vcp_data.delta.jsonl"
+VCP_VALIDITY_DAYS = 730
+VCP_COLUMNS = [
+    "Employee", "Position (English)", "Procedure Number Assigned",
+    "Procedure Number Alternative", "Date Completed",
+    "Due Date", "Status VCP", "Reading", "Upload"
+]
+# Coluna da tabela VCP -> coluna de vcp_records
+VCP_DB_COLUMNS = {
+    "Employee": "employee",
+    "Position (English)": "position",
+    "Procedure Number Assigned": "procedure",
+    "Procedure Number Alternative": "procedure_alternative",
+    "Date Completed": "date_completed",
+    "Due Date": "due_date",
+    "Status VCP": "status_vcp",
+    "Reading": "reading",
+    "Upload": "upload",
+}
+_VCP_CAMPOS = ", ".join(VCP_DB_COLUMNS.values())
+_VCP_NAO_CHAVE = [c for c in list(VCP_DB_COLUMNS.values()) + ["updated_at"] if c not in ("employee", "procedure")]
+_VCP_UPSERT_SQL = f"""
+    INSERT INTO vcp_records ({_VCP_CAMPOS}, updated_at) VALUES ({", ".join("?" * (len(VCP_DB_COLUMNS) + 1))})
+    ON CONFLICT(employee, procedure) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in _VCP_NAO_CHAVE)}
+"""
+_VCP_UPDATE_SQL = f"""
+    UPDATE vcp_records SET {", ".join(f"{c} = ?" for c in VCP_DB_COLUMNS.values())}, updated_at = ? WHERE rowid = ?
+"""
+
+def recalc_vcp(df):
+    """Recalcula Due Date (conclusão + 730 dias), Status VCP e Reading de uma vez para todas as linhas de df."""
+    df = df.copy()
+    concluido = pd.to_datetime(df["Date Completed"], format="%Y-%m-%d", errors="coerce")
+    vencimento = concluido + pd.Timedelta(days=VCP_VALIDITY_DAYS)
+    em_dia = (vencimento >= pd.Timestamp(datetime.today().date())).to_numpy()
+    df["Due Date"] = vencimento.dt.strftime("%Y-%m-%d").astype(object).where(vencimento.notna(), "")
+    df["Status VCP"] = np.where(em_dia, "OK", "Overdue")
+    df["Reading"] = np.where(em_dia, "Completed", "Pending")
+    return df
+
+def _texto_vcp(valor):
+    """Valor de uma célula da tabela VCP como texto para o banco (datas como YYYY-MM-DD)."""
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if isinstance(valor, (datetime, pd.Timestamp)):
+        return valor.strftime("%Y-%m-%d")
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+def _registros_vcp(df):
+    """Tuplas (colunas de vcp_records..., updated_at) das linhas de df; chave ausente vira texto vazio."""
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    df = df.reindex(columns=VCP_COLUMNS)
+    registros = []
+    for linha in df.itertuples(index=False):
+        valores = [_texto_vcp(v) for v in linha]
+        valores[0] = valores[0] or ""
+        valores[2] = valores[2] or ""
+        registros.append(tuple(valores) + (agora,))
+    return registros
+
+def load_vcp_data():
+    """Tabela VCP lida do banco, indexada pelo rowid de cada registro."""
+    with get_db().connection() as conn:
+        df = pd.read_sql_query(f"SELECT rowid AS id, {_VCP_CAMPOS} FROM vcp_records ORDER BY rowid", conn,
+                               index_col="id")
+    df.index.name = None
+    return df.rename(columns={v: k for k, v in VCP_DB_COLUMNS.items()})
+
+def save_vcp_data(df):
+    """Substitui a tabela VCP pelo conteúdo de df (importação).
+
+    Numa única transação: grava cada linha com upsert pela chave (employee, procedure) e apaga
+    os registros cuja chave não está em df.
+    """
+    registros = _registros_vcp(df)
+    with get_db().connection() as conn:
+        conn.executemany(_VCP_UPSERT_SQL, registros)
+        chaves = {(r[0], r[2]) for r in registros}
+        existentes = conn.execute("SELECT employee, procedure FROM vcp_records").fetchall()
+        conn.executemany("DELETE FROM vcp_records WHERE employee = ? AND procedure = ?",
+                         [chave for chave in existentes if chave not in chaves])
+
+def save_vcp_changes(edited=None, added=None, deleted=()):
+    """Grava, numa única transação, as alterações do editor da tabela VCP.
+
+    edited é indexado pelo rowid dos registros alterados (a chave também pode mudar), added são
+    linhas novas (upsert pela chave) e deleted os rowids apagados.
+    """
+    with get_db().connection() as conn:
+        if deleted is not None and len(deleted):
+            conn.executemany("DELETE FROM vcp_records WHERE rowid = ?", [(int(i),) for i in deleted])
+        if edited is not None and not edited.empty:
+            conn.executemany(_VCP_UPDATE_SQL, [registro + (int(rowid),)
+                                               for registro, rowid in zip(_registros_vcp(edited), edited.index)])
+        if added is not None and not added.empty:
+            conn.executemany(_VCP_UPSERT_SQL, _registros_vcp(added))
+
+def set_vcp_upload(employee, file_name):
+    """Registra o arquivo enviado no primeiro registro do funcionário (só grava se mudou)."""
+    with get_db().connection() as conn:
+        conn.execute("""
+            UPDATE vcp_records SET upload = ?, updated_at = ?
+            WHERE rowid = (SELECT MIN(rowid) FROM vcp_records WHERE employee = ?) AND COALESCE(upload, '') != ?
+        """, (file_name, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), _texto_vcp(employee), file_name))
+
+def get_vcp_overview():
+    """Total de registros e quantos estão OK e Overdue, calculados no banco."""
+    with get_db().connection() as conn:
+        total, ok, overdue = conn.execute("""
+            SELECT COUNT(*),
+                   COALESCE(SUM(status_vcp = 'OK'), 0),
+                   COALESCE(SUM(status_vcp = 'Overdue'), 0)
+            FROM vcp_records
+        """).fetchone()
+    return total, ok, overdue
+
+def _ler_vcp_legado():
+    """Tabela VCP salva em arquivo (CSV base mais o diário de alterações), ou None se não houver."""
+    if not os.path.exists(VCP_LEGACY_CSV) and not os.path.exists(VCP_LEGACY_DELTA):
+        return None
+    df = pd.read_csv(VCP_LEGACY_CSV) if os.path.exists(VCP_LEGACY_CSV) else pd.DataFrame(columns=VCP_COLUMNS)
+    if os.path.exists(VCP_LEGACY_DELTA):
+        with open(VCP_LEGACY_DELTA, encoding="utf-8") as f:
+            for entrada in (json.loads(linha) for linha in f if linha.strip()):
+                linhas = pd.DataFrame.from_dict(entrada.get("upsert", {}), orient="index")
+                linhas.index = linhas.index.astype(int)
+                remover = df.index.intersection(linhas.index.union(pd.Index(entrada.get("delete", []), dtype=int)))
+                df = pd.concat([df.drop(index=remover), linhas.reindex(columns=df.columns)]).sort_index()
+    return df
+
+def import_legacy_vcp(conn):
+    """Copia a tabela VCP dos arquivos antigos para vcp_records e renomeia os arquivos (*.migrated)."""
+    df = _ler_vcp_legado()
+    if df is None:
+        return
+    conn.executemany(_VCP_UPSERT_SQL, _registros_vcp(df))
+    for caminho in (VCP_LEGACY_CSV, VCP_LEGACY_DELTA):
+        if os.path.exists(caminho):
+            os.replace(caminho, caminho + ".migrated")
+
+# ========================
+# Ingestão Colunar (xlsx -> Parquet)
+# ========================
+# Colunas realmente usadas pelo pipeline em cada arquivo de entrada
+TEAM_COLUMNS = ["Position in Matrix", "Unisea E-learning User", "Nationality"]
+TRAIN_COLUMNS = [0, 1, 2, 3, 4, 5]
+CONTROL_COLUMNS = [0, 4, 5, 8, 9]  # nome, código, procedimento, status, data de conclusão
+TYPE_COLUMNS = [0, 1, 2]
+UNISEA_COLUMNS = [0, 9]  # código, revisão
+
+def temp_path_for(destino):
+    """Nome temporário único ao lado de destino (dois processos ou jobs nunca compartilham o mesmo)."""
+    return f"{destino}.{uuid.uuid4().hex}.tmp"
+
+@contextmanager
+def atomic_write(destino):
+    """Caminho temporário único para gravar destino, que é substituído por os.replace ao final do bloco.
+
+    Leitores (outro processo, outro job da mesma sessão) nunca veem um arquivo pela metade; se a gravação
+    falhar, o temporário é apagado e destino fica como estava.
+    """
+    temporario = temp_path_for(destino)
+    try:
+        yield temporario
+        os.replace(temporario, destino)
+    except BaseException:
+        _remover_se_existir(temporario)
+        raise
+
+def _remover_se_existir(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Colunas object com tipos misturados (ex.: datas e "N/A" na mesma coluna) são gravadas como struct,
+# com um campo por tipo, e voltam na leitura com os mesmos valores que o read_excel devolveu
+MIXED_COLUMN_FIELDS = [("texto", pa.string()), ("inteiro", pa.int64()), ("real", pa.float64()),
+                       ("data", pa.timestamp("us")), ("logico", pa.bool_())]
+MIXED_COLUMN_METADATA = {b"training_engine": b"mixed"}
+# Versão do formato gravado por write_parquet e pela ingestão em lotes; Parquets de outra versão são
+# gerados de novo a partir do xlsx (incrementar ao mudar a forma como as células são gravadas)
+PARQUET_FORMAT_VERSION = 2
+
+def _com_versao_formato(schema):
+    versao = str(PARQUET_FORMAT_VERSION).encode()
+    return schema.with_metadata({**(schema.metadata or {}), b"training_engine_format": versao})
+
+def parquet_format_version(parquet_path):
+    """Versão do formato de um Parquet (None se gravado antes do controle de versão ou ilegível)."""
+    try:
+        metadados = pq.read_schema(parquet_path).metadata or {}
+    except Exception:
+        return None
+    versao = metadados.get(b"training_engine_format")
+    return int(versao) if versao is not None else None
+
+def _campo_misto(valor):
+    if isinstance(valor, str):
+        return "texto"
+    if isinstance(valor, (bool, np.bool_)):
+        return "logico"
+    if isinstance(valor, (int, np.integer)):
+        return "inteiro" if -2 ** 63 <= valor < 2 ** 63 else "texto"
+    if isinstance(valor, (float, np.floating)):
+        return "real"
+    if isinstance(valor, datetime):
+        return "data"
+    return "texto"  # outros tipos (ex.: horas) ficam como texto
+
+def mixed_column_array(valores):
+    """Array struct de uma coluna mista: cada valor vai para o campo do seu tipo, os demais ficam nulos."""
+    campos = {nome: [None] * len(valores) for nome, _ in MIXED_COLUMN_FIELDS}
+    nulos = pd.isna(valores)
+    for i in np.flatnonzero(~nulos):
+        valor = valores[i]
+        campo = _campo_misto(valor)
+        campos[campo][i] = str(valor) if campo == "texto" else valor
+    return pa.StructArray.from_arrays([pa.array(campos[nome], type=tipo) for nome, tipo in MIXED_COLUMN_FIELDS],
+                                      fields=[pa.field(nome, tipo) for nome, tipo in MIXED_COLUMN_FIELDS],
+                                      mask=pa.array(nulos))
+
+def _coluna_mista(campo):
+    return campo.metadata is not None and campo.metadata.get(b"training_engine") == b"mixed"
+
+def _decodificar_coluna_mista(coluna):
+    """Valores Python de uma coluna struct mista; nulos viram NaN, como no read_excel."""
+    coluna = coluna.combine_chunks() if isinstance(coluna, pa.ChunkedArray) else coluna
+    valores = np.full(len(coluna), np.nan, dtype=object)
+    for nome, _ in MIXED_COLUMN_FIELDS:
+        campo = coluna.field(nome)
+        validos = campo.is_valid().to_numpy(zero_copy_only=False)
+        if validos.any():
+            preenchidos = np.empty(int(validos.sum()), dtype=object)
+            preenchidos[:] = campo.filter(pa.array(validos)).to_pylist()
+            valores[validos] = preenchidos
+    return valores
+
+def table_to_pandas(tabela):
+    """Converte uma tabela Arrow para DataFrame, devolvendo as colunas mistas com os tipos originais."""
+    mistas = [i for i, campo in enumerate(tabela.schema) if _coluna_mista(campo)]
+    if not mistas:
+        return tabela.to_pandas()
+    df = tabela.drop_columns([tabela.schema.names[i] for i in mistas]).to_pandas()
+    for i in mistas:
+        df.insert(i, tabela.schema.names[i], _decodificar_coluna_mista(tabela.column(i)))
+    return df
+
+def read_parquet(path, columns=None):
+    """Lê um Parquet gravado por write_parquet (todo ou só as colunas pedidas)."""
+    return table_to_pandas(pq.read_table(path, columns=columns))
+
+def write_parquet(df, path, compression="snappy", mixed_as_text=False):
+    """Grava um DataFrame em Parquet.
+
+    Colunas object só de texto ficam como string; com tipos misturados viram o struct de
+    MIXED_COLUMN_FIELDS, que read_parquet desfaz. Com mixed_as_text=True (arquivos exportados,
+    abertos fora do sistema) elas são gravadas como texto.
+    """
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    mistas = {}
+    for col in df.columns:
+        categorias_object = isinstance(df[col].dtype, pd.CategoricalDtype) and df[col].cat.categories.dtype == object
+        if df[col].dtype == object and not mixed_as_text and \
+                not all(isinstance(v, str) for v in df[col].dropna()):
+            mistas[col] = mixed_column_array(df[col].to_numpy())
+        elif df[col].dtype == object or categorias_object:
+            df[col] = df[col].astype(object).map(lambda v: v if pd.isnull(v) else str(v))
+    demais = pa.Table.from_pandas(df.drop(columns=list(mistas)), preserve_index=False)
+    campos = [pa.field(col, mistas[col].type, metadata=MIXED_COLUMN_METADATA) if col in mistas
+              else demais.schema.field(col) for col in df.columns]
+    tabela = pa.Table.from_arrays([mistas[col] if col in mistas else demais.column(col) for col in df.columns],
+                                  schema=_com_versao_formato(pa.schema(campos, metadata=demais.schema.metadata)))
+    pq.write_table(tabela, path, compression=compression)
+
+def parquet_path_for(xlsx_path):
+    return os.path.splitext(xlsx_path)[0] + ".parquet"
+
+def ingest_excel(xlsx_path):
+    """Converte um xlsx recém-salvo para Parquet; o xlsx fica apenas como arquivo original."""
+    parquet_path = parquet_path_for(xlsx_path)
+    with atomic_write(parquet_path) as temporario:  # outro processo pode estar lendo o mesmo blob
+        write_parquet(pd.read_excel(xlsx_path), temporario)
+    return parquet_path
+
+def _nomes_colunas(cabecalho):
+    """Nomes de coluna como o pandas gera: vazios viram 'Unnamed: i' e repetidos ganham sufixo '.n'."""
+    nomes, vistos = [], {}
+    for i, valor in enumerate(cabecalho):
+        nome = f"Unnamed: {i}" if valor is None else str(valor)
+        if nome in vistos:
+            vistos[nome] += 1
+            nome = f"{nome}.{vistos[nome]}"
+        vistos.setdefault(nome, 0)
+        nomes.append(nome)
+    return nomes
+
+def stream_parquet_path_for(xlsx_path):
+    """Parquet do modo de baixa memória; fica separado do Parquet da leitura normal."""
+    return os.path.splitext(xlsx_path)[0] + ".stream.parquet"
+
+# Textos que o read_excel trata como vazio (na_values padrão do pandas)
+NA_STRINGS = {"", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN", "<NA>",
+              "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"}
+TEXTO_INTEIRO = re.compile(r"[+-]?\d{1,18}")
+TEXTO_REAL = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?")
+TIPOS_CELULA = ["texto", "texto_inteiro", "texto_real", "inteiro", "real", "data", "logico"]
+
+def _celula_como_pandas(valor):
+    """Valor de uma célula como o leitor do pandas o entrega: inteiros como int e textos nulos como vazio."""
+    if isinstance(valor, str):
+        return None if valor in NA_STRINGS else valor
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+def _tipo_celula(valor):
+    if isinstance(valor, str):
+        if TEXTO_INTEIRO.fullmatch(valor):
+            return "texto_inteiro"
+        return "texto_real" if TEXTO_REAL.fullmatch(valor) else "texto"
+    campo = _campo_misto(valor)
+    return "texto" if campo == "texto" else campo
+
+def _tipo_como_pandas(contagem, vazios):
+    """Tipo que o read_excel daria a uma coluna, pelos tipos de valor vistos nela na leitura em lotes.
+
+    None indica uma coluna mista (object no pandas), gravada como o struct de MIXED_COLUMN_FIELDS.
+    """
+    preenchidos = sum(contagem.values())
+    inteiros = contagem["inteiro"] + contagem["texto_inteiro"]
+    if preenchidos == 0:
+        return pa.float64()
+    if inteiros + contagem["real"] + contagem["texto_real"] == preenchidos:
+        # Textos numéricos também viram números; com vazios ou frações a coluna é promovida a float
+        return pa.int64() if inteiros == preenchidos and not vazios else pa.float64()
+    if contagem["logico"] == preenchidos:
+        return pa.float64() if vazios else pa.bool_()
+    if contagem["data"] == preenchidos:
+        return pa.timestamp("us")
+    if contagem["texto"] + contagem["texto_inteiro"] + contagem["texto_real"] == preenchidos:
+        return pa.string()
+    return None
+
+def _coluna_tipada(coluna, tipo):
+    """Converte uma coluna struct da primeira passada para o tipo final."""
+    campo = {nome: coluna.field(nome) for nome, _ in MIXED_COLUMN_FIELDS}
+    if tipo == pa.string():
+        return campo["texto"]
+    if tipo == pa.timestamp("us"):
+        return campo["data"]
+    if tipo == pa.bool_():
+        return campo["logico"]
+    return pc.coalesce(*[campo[nome].cast(tipo) for nome in ("inteiro", "real", "texto", "logico")
+                         if campo[nome].null_count < len(coluna)] or [pa.nulls(len(coluna), tipo)])
+
+def _gravar_celulas_tipadas(xlsx_path, destino, chunk_rows):
+    """Primeira passada da ingestão em lotes: grava cada célula com o seu tipo e conta os tipos por coluna."""
+    import openpyxl  # só aqui: adiar a importação deixa o "import training_engine" mais rápido
+
+    wb = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        nomes = _nomes_colunas(next(linhas, ()))
+        struct = pa.struct([pa.field(nome, tipo) for nome, tipo in MIXED_COLUMN_FIELDS])
+        schema = pa.schema([(nome, struct) for nome in nomes])
+        contagens = [dict.fromkeys(TIPOS_CELULA, 0) for _ in nomes]
+        vazios = [False] * len(nomes)
+        linhas_vazias = 0
+
+        def tabela(lote):
+            colunas = list(zip(*lote)) if lote else [[] for _ in nomes]
+            arrays = []
+            for coluna in colunas:
+                valores = np.empty(len(coluna), dtype=object)
+                valores[:] = coluna
+                arrays.append(mixed_column_array(valores))
+            return pa.Table.from_arrays(arrays, schema=schema)
+
+        with pq.ParquetWriter(destino, schema) as writer:
+            lote = []
+            for linha in linhas:
+                if all(v is None for v in linha):
+                    linhas_vazias += 1
+                    continue
+                if linhas_vazias:
+                    # O pandas mantém linhas vazias no meio da planilha (como NaN) e descarta as do final
+                    lote.extend([[None] * len(nomes)] * linhas_vazias)
+                    vazios = [True] * len(nomes)
+                    linhas_vazias = 0
+                linha = [_celula_como_pandas(v) for v in (tuple(linha) + (None,) * len(nomes))[:len(nomes)]]
+                for i, v in enumerate(linha):
+                    if v is None:
+                        vazios[i] = True
+                    else:
+                        contagens[i][_tipo_celula(v)] += 1
+                lote.append(linha)
+                if len(lote) >= chunk_rows:
+                    writer.write_table(tabela(lote))
+                    lote = []
+            if lote:
+                writer.write_table(tabela(lote))
+    finally:
+        wb.close()
+    return nomes, struct, contagens, vazios
+
+def ingest_excel_streaming(xlsx_path, chunk_rows=50_000):
+    """Converte um xlsx para Parquet em lotes de linhas (openpyxl read_only), sem carregar a planilha inteira.
+
+    Como no read_excel, linhas vazias no fim da planilha são descartadas. A primeira passada grava cada
+    célula com o seu tipo (o struct de MIXED_COLUMN_FIELDS) e conta os tipos de cada coluna; a segunda,
+    também em lotes, dá a cada coluna o tipo que o read_excel daria (ex.: códigos com vazios viram float,
+    "201.0"; datas com "N/A" viram datas), para o modo de baixa memória ver os mesmos valores que o normal.
+    """
+    parquet_path = stream_parquet_path_for(xlsx_path)
+    primeira = temp_path_for(parquet_path)
+    try:
+        nomes, struct, contagens, vazios = _gravar_celulas_tipadas(xlsx_path, primeira, chunk_rows)
+        tipos = [_tipo_como_pandas(contagem, vazio) for contagem, vazio in zip(contagens, vazios)]
+        final = _com_versao_formato(pa.schema([pa.field(nome, struct, metadata=MIXED_COLUMN_METADATA) if tipo is None
+                                               else pa.field(nome, tipo) for nome, tipo in zip(nomes, tipos)]))
+        with atomic_write(parquet_path) as temporario, pq.ParquetWriter(temporario, final) as writer:
+            for lote in pq.ParquetFile(primeira).iter_batches(batch_size=chunk_rows):
+                colunas = [lote.column(i) if tipo is None else _coluna_tipada(lote.column(i), tipo)
+                           for i, tipo in enumerate(tipos)]
+                writer.write_table(pa.Table.from_arrays(colunas, schema=final))
+    finally:
+        _remover_se_existir(primeira)
+    return parquet_path
+
+def ensure_ingested(path, streaming=False):
+    """Gera o Parquet de um xlsx se ele não existir, estiver desatualizado ou em outro formato; retorna o caminho.
+
+    streaming=True usa a leitura em lotes, gravada num Parquet próprio (stream_parquet_path_for).
+    """
+    parquet_path = stream_parquet_path_for(path) if streaming else parquet_path_for(path)
+    if not os.path.exists(parquet_path) or os.path.getmtime(parquet_path) < os.path.getmtime(path) or \
+            parquet_format_version(parquet_path) != PARQUET_FORMAT_VERSION:
+        if streaming:
+            ingest_excel_streaming(path)
+        else:
+            ingest_excel(path)
+    return parquet_path
+
+def read_input(path, columns=None, positions=None):
+    """Lê um arquivo de entrada a partir do Parquet convertido, trazendo só as colunas necessárias.
+
+    columns seleciona por nome (ignorando as ausentes); positions seleciona por posição.
+    Se o Parquet não existir ou estiver desatualizado em relação ao xlsx, ele é gerado antes.
+    """
+    parquet_path = ensure_ingested(path)
+    disponiveis = pq.ParquetFile(parquet_path).schema_arrow.names
+    if positions is not None:
+        selecionadas = [disponiveis[i] for i in positions]
+    elif columns is not None:
+        selecionadas = [c for c in columns if c in disponiveis]
+    else:
+        selecionadas = None
+    return read_parquet(parquet_path, columns=selecionadas)
+
+def read_control_filtered(path, codigos, batch_size=100_000):
+    """Modo de baixa memória: lê o Control em lotes e mantém só as linhas cujo código está em codigos."""
+    arquivo = pq.ParquetFile(ensure_ingested(path, streaming=True))
+    disponiveis = arquivo.schema_arrow.names
+    selecionadas = [disponiveis[i] for i in CONTROL_COLUMNS]
+    lotes = []
+    for lote in arquivo.iter_batches(batch_size=batch_size, columns=selecionadas):
+        df_lote = table_to_pandas(pa.Table.from_batches([lote]))
+        manter = df_lote.iloc[:, 1].astype(str).str.strip().isin(codigos)
+        if manter.any():
+            lotes.append(df_lote[manter])
+    if not lotes:
+        return table_to_pandas(arquivo.schema_arrow.empty_table().select(selecionadas))
+    return pd.concat(lotes, ignore_index=True)
+
+# ========================
+# Control Matching Engine
+# ========================
+MATCH_COLUMNS = ['control_status', 'control_data_completo', 'control_nome', 'control_rev', 'match_score']
+MAX_WORKERS = os.cpu_count() or 1
+
+def build_control_index(df_control):
+    """Indexa o Control uma única vez: código de procedimento -> posições das linhas (em ordem)."""
+    codigos = df_control['procedimento_num_controle']
+    posicoes = pd.Series(np.arange(len(df_control)), index=codigos.index)
+    index = posicoes.groupby(codigos.to_numpy(), dropna=False, sort=False).indices
+    nomes = df_control['nome_padrao'].to_numpy(dtype=object)
+    return {
+        "posicoes": {codigo: np.sort(pos) for codigo, pos in index.items()},
+        "nome_padrao": nomes,
+        "nome_normalizado": np.array([normalize_text(n) for n in nomes], dtype=object),
+        "status": df_control['status'].to_numpy(dtype=object),
+        "data": df_control['control_data_completo'].to_numpy(dtype="datetime64[ns]"),
+        "rev": df_control['rev'].to_numpy(dtype=object),
+    }
+
+def _codigos_da_linha(atribuido, alternativo):
+    codigo_atribuido = str(atribuido).strip()
+    codigo_alternativo = str(alternativo).strip() if pd.notnull(alternativo) else ''
+    if codigo_alternativo and codigo_alternativo != codigo_atribuido:
+        return tuple(sorted((codigo_atribuido, codigo_alternativo)))
+    return (codigo_atribuido,)
+
+def _melhor_exata(index, posicoes):
+    # Entre correspondências exatas, prevalece a data de conclusão mais recente (primeira em caso de empate)
+    datas = index["data"][posicoes]
+    validas = ~np.isnat(datas)
+    if validas.any():
+        return posicoes[validas][np.argmax(datas[validas])]
+    return posicoes[0]
+
+def match_control_block(index, codigos, nomes_usuario, threshold, workers=1):
+    """Faz o match de todos os usuários de um mesmo bloco de códigos contra os candidatos do Control.
+
+    Retorna, para cada nome, a posição da linha do Control escolhida (ou None) e o score.
+    """
+    blocos = [index["posicoes"][c] for c in codigos if c in index["posicoes"]]
+    if not blocos:
+        return {nome: (None, 0) for nome in nomes_usuario}
+    candidatos = blocos[0] if len(blocos) == 1 else np.union1d(*blocos)
+
+    exatas = {}
+    for pos in candidatos:
+        nome = index["nome_padrao"][pos]
+        if pd.notnull(nome):
+            exatas.setdefault(nome, []).append(pos)
+
+    resultado, pendentes = {}, []
+    for nome in nomes_usuario:
+        if pd.notnull(nome) and nome in exatas:
+            resultado[nome] = (_melhor_exata(index, np.array(exatas[nome])), 100)
+        else:
+            pendentes.append(nome)
+    if not pendentes:
+        return resultado
+
+    # Score em lote; argmax devolve o primeiro candidato com o maior score, como no laço original
+    scores = process.cdist([normalize_text(n) for n in pendentes], index["nome_normalizado"][candidatos],
+                           scorer=fuzz.ratio, dtype=np.float64, workers=workers)
+    melhores = scores.argmax(axis=1)
+    for nome, melhor, linha in zip(pendentes, melhores, scores):
+        melhor_score = linha[melhor]
+        if melhor_score > 0 and melhor_score >= threshold:
+            resultado[nome] = (candidatos[melhor], melhor_score)
+        else:
+            resultado[nome] = (None, melhor_score)
+    return resultado
+
+def match_control(df_result, df_control, threshold=80, workers=1):
+    """Aplica o match com o Control em blocos por código de procedimento.
+
+    Com workers > 1 o score de cada bloco é calculado em paralelo pelo rapidfuzz;
+    o resultado é idêntico ao do modo serial.
+    """
+    index = build_control_index(df_control)
+    chaves = [_codigos_da_linha(a, b) for a, b in zip(df_result['procedimento_num_assigned'],
+                                                      df_result['procedimento_num_alternative'])]
+    # Nulos viram o mesmo objeto np.nan para que possam ser usados como chave de dicionário
+    nomes = np.array([np.nan if pd.isnull(n) else n for n in df_result['nome_padrao']], dtype=object)
+    blocos = {}
+    for i, chave in enumerate(chaves):
+        blocos.setdefault(chave, []).append(i)
+
+    escolhidos = np.full(len(df_result), -1, dtype=np.int64)
+    scores = np.zeros(len(df_result), dtype=np.float64)
+    for chave, linhas in blocos.items():
+        nomes_bloco = list(dict.fromkeys(nomes[linhas]))
+        resultado = match_control_block(index, chave, nomes_bloco, threshold, workers)
+        for i in linhas:
+            pos, score = resultado[nomes[i]]
+            escolhidos[i] = -1 if pos is None else pos
+            scores[i] = score
+
+    encontrados = escolhidos >= 0
+    posicoes = escolhidos[encontrados]
+    saida = pd.DataFrame(index=df_result.index)
+    for coluna, origem in [('control_status', "status"), ('control_nome', "nome_padrao"), ('control_rev', "rev")]:
+        valores = np.full(len(df_result), None, dtype=object)
+        valores[encontrados] = index[origem][posicoes]
+        saida[coluna] = valores
+    datas = np.full(len(df_result), np.datetime64("NaT"), dtype="datetime64[ns]")
+    datas[encontrados] = index["data"][posicoes]
+    saida['control_data_completo'] = datas
+    saida['match_score'] = scores
+    return saida[MATCH_COLUMNS]
+
+# ========================
+# Data Processing Function
+# ========================
+# Etapas do pipeline, na ordem de execução
+PIPELINE_STAGES = {
+    "merge": "Team × Trainings merge",
+    "match": "Control matching",
+    "categorize": "Training type categorization",
+    "revisions": "Unisea revision comparison",
+}
+
+def merge_team_trainings(team_file, train_file):
+    """Etapa 1: cruza Team com Trainings e escolhe o código atribuído/alternativo pela nacionalidade."""
+    # Lê o arquivo Team e separa as colunas de posição
+    df_team = read_input(team_file, columns=TEAM_COLUMNS)
+    if "Position in Matrix" not in df_team.columns:
+        raise ValueError("Column 'Position in Matrix' not found in Team.xlsx.")
+    df_team[['cargo_en_team', 'cargo_pt_team']] = df_team["Position in Matrix"].str.split("\n", n=1, expand=True)
+    df_team['cargo_en_team'] = df_team['cargo_en_team'].str.strip()
+    df_team['cargo_pt_team'] = df_team['cargo_pt_team'].str.strip()
+
+    # Lê o arquivo Trainings
+    df_train = read_input(train_file, positions=TRAIN_COLUMNS)
+    df_train.columns = ['cargo_en_train', 'cargo_pt_train', 'procedimento_nome',
+                        'procedimento_num_en', 'procedimento_num_pt', 'requisito']
+    df_merged = pd.merge(df_team, df_train, left_on='cargo_pt_team', right_on='cargo_pt_train', how='left')
+    # Brasileiros usam o código PT como atribuído e o EN como alternativo; os demais, o inverso
+    if 'Nationality' in df_merged.columns:
+        brasileiro = df_merged['Nationality'].astype(str).str.upper().eq('BR').fillna(False).to_numpy(dtype=bool)
+    else:
+        brasileiro = np.zeros(len(df_merged), dtype=bool)
+    df_merged['procedimento_num_assigned'] = df_merged['procedimento_num_pt'].where(brasileiro, df_merged['procedimento_num_en'])
+    df_merged['procedimento_num_alternative'] = df_merged['procedimento_num_en'].where(brasileiro, df_merged['procedimento_num_pt'])
+    df_result = df_merged[['Unisea E-learning User', 'cargo_pt_team', 'cargo_en_team',
+                           'procedimento_nome', 'procedimento_num_assigned',
+                           'procedimento_num_alternative', 'requisito']].copy()
+    df_result['nome_padrao'] = df_result['Unisea E-learning User'].astype(str).str.upper().str.strip()
+    return df_result
+
+def match_control_stage(df_result, control_file, fuzzy_threshold=80, workers=1, low_memory=False):
+    """Etapa 2: lê o Control e faz o match; retorna as colunas de match e a inconsistência.
+
+    Com low_memory=True o Control é lido em lotes e só as linhas com códigos atribuídos/alternativos
+    presentes no resultado são mantidas (o match só considera esses códigos, então o resultado é o mesmo).
+    """
+    if low_memory:
+        codigos = set()
+        for a, b in zip(df_result['procedimento_num_assigned'], df_result['procedimento_num_alternative']):
+            codigos.update(_codigos_da_linha(a, b))
+        df_control = read_control_filtered(control_file, codigos)
+    else:
+        df_control = read_input(control_file, positions=CONTROL_COLUMNS)
+    df_control['nome_padrao'] = df_control.iloc[:, 0].astype(str).str.upper().str.strip()
+    df_control['procedimento_num_controle'] = df_control.iloc[:, 1].astype(str).str.strip()
+    df_control['procedimento_nome_controle'] = df_control.iloc[:, 2].astype(str).str.upper().str.strip()
+    df_control['rev'] = df_control['procedimento_nome_controle'].str[-7:]
+    df_control['status'] = df_control.iloc[:, 3]
+    df_control['control_data_completo'] = pd.to_datetime(df_control.iloc[:, 4], errors='coerce')
+    df_control = df_control[['nome_padrao', 'procedimento_num_controle', 'rev', 'status', 'control_data_completo']]
+
+    # Match com o Control em blocos indexados por código de procedimento
+    df_match = match_control(df_result, df_control, fuzzy_threshold, workers)
+    df_match['inconsistencia'] = df_match['control_status'].isnull() | (df_match['match_score'] < 100)
+    return df_match
+
+def build_categoria_map(df_type):
+    """Mapa código -> categoria; vale a primeira linha da listagem cujo código EN ou PT coincide."""
+    posicoes = np.arange(len(df_type))
+    codigos = pd.concat([
+        pd.DataFrame({'codigo': df_type[coluna].astype(str).str.strip().to_numpy(),
+                      'posicao': posicoes, 'categoria': df_type['categoria'].to_numpy()})
+        for coluna in ['procedimento_num_en_type', 'procedimento_num_pt_type']
+    ])
+    codigos = codigos.dropna(subset=['codigo']).sort_values('posicao', kind='stable').drop_duplicates('codigo')
+    return pd.Series(codigos['categoria'].to_numpy(), index=codigos['codigo'].to_numpy())
+
+def categorize_trainings(df_result, training_type_file=None):
+    """Etapa 3: categoria de cada treinamento pelo Training Type Listing (opcional)."""
+    df_categoria = pd.DataFrame(index=df_result.index)
+    if training_type_file is not None:
+        df_type = read_input(training_type_file, positions=TYPE_COLUMNS)
+        df_type.columns = ['procedimento_num_en_type', 'procedimento_num_pt_type', 'categoria']
+        mapa_categorias = build_categoria_map(df_type)
+        procedimentos = df_result['procedimento_num_assigned'].astype(str).str.strip()
+        df_categoria['categoria'] = procedimentos.map(mapa_categorias)
+    else:
+        df_categoria['categoria'] = None
+    return df_categoria
+
+def compare_revisions(df_result, unisea_file=None):
+    """Etapa 4: compara a revisão do Control com a do Unisea (opcional) e monta a tabela final."""
+    df_result = df_result.copy()
+    if unisea_file is not None:
+        df_unisea = read_input(unisea_file, positions=UNISEA_COLUMNS)
+        df_unisea.columns = ['procedimento_num_unisea', 'rev_unisea']
+        df_unisea['procedimento_num_unisea'] = df_unisea['procedimento_num_unisea'].astype(str).str.strip()
+        df_result['procedimento_num_assigned'] = df_result['procedimento_num_assigned'].astype(str).str.strip()
+        df_result = df_result.merge(df_unisea[['procedimento_num_unisea', 'rev_unisea']],
+                                     left_on='procedimento_num_assigned',
+                                     right_on='procedimento_num_unisea', how='left')
+        df_result.drop(columns=['procedimento_num_unisea'], inplace=True)
+        # Concluído com revisões diferentes -> Retreinamento; sem revisão em um dos lados -> OK
+        concluido = normalize_text_series(df_result['control_status']).eq("completed").fillna(False).to_numpy(dtype=bool)
+        rev_control = extract_revision_series(df_result['control_rev']).to_numpy()
+        rev_unisea = extract_revision_series(df_result['rev_unisea']).to_numpy()
+        revisao_diferente = ~np.isnan(rev_control) & ~np.isnan(rev_unisea) & (rev_control != rev_unisea)
+        df_result['status_final'] = np.where(~concluido, "Not started",
+                                             np.where(revisao_diferente, "Retreinamento", "OK"))
+    else:
+        df_result['status_final'] = df_result['control_status']
+
+    colunas_final = ['Unisea E-learning User', 'cargo_pt_team', 'cargo_en_team', 'procedimento_nome',
+                     'procedimento_num_assigned', 'procedimento_num_alternative', 'requisito',
+                     'categoria', 'control_status', 'control_nome', 'control_rev', 'rev_unisea',
+                     'status_final', 'control_data_completo', 'match_score', 'inconsistencia']
+    return df_result[colunas_final]
+
+# Colunas de texto com muitos valores repetidos, guardadas como categóricas
+CATEGORICAL_COLUMNS = ['Unisea E-learning User', 'cargo_pt_team', 'cargo_en_team', 'procedimento_nome',
+                       'procedimento_num_assigned', 'procedimento_num_alternative', 'requisito',
+                       'categoria', 'control_status', 'control_nome', 'control_rev', 'rev_unisea', 'status_final']
+
+def compact_report(df_final):
+    """Reduz a memória da tabela final mantida na sessão da interface.
+
+    Texto repetido vira categórico, match_score vira inteiro sem sinal de 8 bits (truncado, o que
+    preserva a comparação com o fuzzy threshold inteiro) e inconsistencia vira bool.
+    """
+    df_final = df_final.copy()
+    for col in CATEGORICAL_COLUMNS:
+        if col in df_final.columns:
+            # Valores de tipos misturados (ex.: revisão 3 e "REV 3") viram texto antes de categorizar
+            df_final[col] = df_final[col].astype(str).where(df_final[col].notna()).astype('category')
+    df_final['match_score'] = np.floor(df_final['match_score'].astype(float)).astype('UInt8')
+    df_final['inconsistencia'] = df_final['inconsistencia'].astype(bool)
+    return df_final
+
+def run_pipeline(team_file, train_file, control_file, training_type_file=None, unisea_file=None,
+                 fuzzy_threshold=80, workers=1, use_cache=False, low_memory=False, progress=None, profiler=None):
+    """Executa as etapas do pipeline em sequência.
+
+    Com use_cache=True cada etapa é memoizada por uma chave derivada das suas próprias entradas
+    (hash dos arquivos e chaves das etapas anteriores), de modo que trocar um único arquivo
+    recalcula apenas as etapas que dependem dele. progress, se informado, é chamado com o nome
+    de cada etapa antes de ela começar; profiler (StageProfiler), se informado, mede cada etapa.
+    Retorna (df_final, etapas reaproveitadas); erros são propagados.
+    """
+    reaproveitadas = []
+
+    def etapa(nome, partes_chave, calcular):
+        if progress is not None:
+            progress(PIPELINE_STAGES[nome])
+        with profiler.stage(PIPELINE_STAGES[nome]) if profiler is not None else nullcontext({}) as medida:
+            df, key = executar(nome, partes_chave, calcular)
+            medida["rows"] = None if df is None else len(df)
+            medida["cached"] = PIPELINE_STAGES[nome] in reaproveitadas
+        return df, key
+
+    def executar(nome, partes_chave, calcular):
+        if not use_cache:
+            return calcular(), None
+        key = stage_key(nome, *partes_chave)
+        df = load_stage(key)
+        if df is not None:
+            reaproveitadas.append(PIPELINE_STAGES[nome])
+            return df, key
+        df = calcular()
+        if df is not None:
+            save_stage(key, df)
+        return df, key
+
+    arquivos = [team_file, train_file, control_file, training_type_file, unisea_file]
+    h_team, h_train, h_control, h_type, h_unisea = [content_hash(p) for p in arquivos] if use_cache else [None] * 5
+
+    df_result, k_merge = etapa("merge", [h_team, h_train],
+                               lambda: merge_team_trainings(team_file, train_file))
+    df_match, k_match = etapa("match", [k_merge, h_control, fuzzy_threshold, low_memory],
+                              lambda: match_control_stage(df_result, control_file, fuzzy_threshold, workers, low_memory))
+    df_categoria, k_categoria = etapa("categorize", [k_merge, h_type],
+                                      lambda: categorize_trainings(df_result, training_type_file))
+    df_final, _ = etapa("revisions", [k_match, k_categoria, h_unisea],
+                        lambda: compare_revisions(pd.concat([df_result, df_match, df_categoria], axis=1), unisea_file))
+    return compact_report(df_final), reaproveitadas
+
+def process_data(team_file, train_file, control_file, training_type_file=None, unisea_file=None, fuzzy_threshold=80, workers=1,
+                 low_memory=False):
+    df_final, _ = run_pipeline(team_file, train_file, control_file, training_type_file, unisea_file, fuzzy_threshold, workers,
+                               low_memory=low_memory)
+    return df_final
+
+# ========================
+# Cache de Etapas do Pipeline
+# ========================
+UPLOAD_DIR = "uploaded_files"
+CACHE_DIR = os.path.join(UPLOAD_DIR, ".report_cache")
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+# Versão da lógica do pipeline, parte de toda chave de etapa: incrementar a cada mudança que altere o
+# resultado de alguma etapa, para que as etapas gravadas pela versão anterior não sejam reaproveitadas
+PIPELINE_CACHE_VERSION = 2
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Calcula o SHA-256 do conteúdo de um arquivo (None se o arquivo não existir)."""
+    if path is None or not os.path.exists(path):
+        return None
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def stage_key(nome, *partes):
+    """Chave de uma etapa: versão do pipeline + nome da etapa + hashes/parâmetros das suas entradas."""
+    partes = [str(PIPELINE_CACHE_VERSION), nome] + ["-" if p is None else str(p) for p in partes]
+    return hashlib.sha256("|".join(partes).encode("utf-8")).hexdigest()
+
+def load_stage(key):
+    cache_path = os.path.join(CACHE_DIR, f"{key}.parquet")
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        df = read_parquet(cache_path)
+    except Exception:
+        return None
+    os.utime(cache_path)  # marca como usado recentemente (LRU)
+    return df
+
+def save_stage(key, df):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(CACHE_DIR, f"{key}.parquet")
+    try:
+        with atomic_write(cache_path) as temporario:
+            write_parquet(df, temporario)
+    except Exception as e:
+        logger.warning("Could not cache a pipeline stage: %s", e)
+        return
+    evict_report_cache()
+
+def evict_report_cache(max_bytes=CACHE_MAX_BYTES):
+    """Remove as entradas menos usadas recentemente até o cache caber em max_bytes."""
+    entradas = []
+    for nome in os.listdir(CACHE_DIR):
+        caminho = os.path.join(CACHE_DIR, nome)
+        try:
+            info = os.stat(caminho)
+        except FileNotFoundError:
+            continue  # removido por outro processo no meio da listagem
+        entradas.append((info.st_mtime, info.st_size, caminho))
+    total = sum(tamanho for _, tamanho, _ in entradas)
+    for _, tamanho, caminho in sorted(entradas):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        total -= tamanho
+
+def process_data_cached(team_file, train_file, control_file, training_type_file=None, unisea_file=None, fuzzy_threshold=80, workers=1,
+                        low_memory=False):
+    """Executa o pipeline reaproveitando as etapas cujas entradas não mudaram.
+
+    Retorna (df_final, etapas reaproveitadas).
+    """
+    return run_pipeline(team_file, train_file, control_file, training_type_file, unisea_file,
+                        fuzzy_threshold, workers, use_cache=True, low_memory=low_memory)
+
+# ========================
+# Medição de Desempenho
+# ========================
+PROFILE_TOP_FUNCTIONS = 40
+METRICS_TREND_RUNS = 200
+
+def _rss_atual():
+    """Memória residente do processo em bytes (None se a plataforma não expõe)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _mb(valor):
+    return None if valor is None else round(valor / 1024 / 1024, 1)
+
+class PeakMemorySampler(threading.Thread):
+    """Amostra a memória residente em segundo plano e guarda o maior valor desde o último reset()."""
+
+    def __init__(self, interval=0.01):
+        super().__init__(name="peak-memory-sampler", daemon=True)
+        self.interval = interval
+        self.peak = _rss_atual()
+        self._parar = threading.Event()
+
+    def run(self):
+        while not self._parar.wait(self.interval):
+            atual = _rss_atual()
+            if atual is not None:
+                self.peak = max(self.peak or 0, atual)
+
+    def reset(self):
+        self.peak = _rss_atual()
+
+    def stop(self):
+        self._parar.set()
+        self.join()
+
+class StageProfiler:
+    """Tempo, linhas e pico de memória de cada etapa de um processamento, com cProfile opcional.
+
+    A memória é a do processo inteiro: com outros jobs rodando ao mesmo tempo, o pico inclui os deles.
+    O cProfile só enxerga a thread que chamou start() (não as threads do match paralelo).
+    """
+
+    def __init__(self, profile=False):
+        self.stages = []
+        self.total_seconds = None
+        self.peak_rss_mb = None
+        self.profile_text = None
+        self._perfil = cProfile.Profile() if profile else None
+        self._amostrador = PeakMemorySampler()
+        self._inicio = None
+
+    def start(self):
+        self._amostrador.start()
+        if self._perfil is not None:
+            try:
+                self._perfil.enable()
+            except ValueError as e:  # outro profiler ativo no processo (Python 3.12+)
+                self._perfil = None
+                self.profile_text = f"cProfile unavailable: {e}"
+        self._inicio = time.perf_counter()
+
+    def stop(self):
+        self.total_seconds = round(time.perf_counter() - self._inicio, 4)
+        if self._perfil is not None:
+            self._perfil.disable()
+            saida = io.StringIO()
+            pstats.Stats(self._perfil, stream=saida).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            self.profile_text = saida.getvalue()
+        self._amostrador.stop()
+        picos = [etapa["peak_rss_mb"] for etapa in self.stages if etapa["peak_rss_mb"] is not None]
+        self.peak_rss_mb = max(picos) if picos else None
+
+    @contextmanager
+    def stage(self, nome):
+        """Mede o bloco como uma etapa; o dicionário retornado aceita campos extras (ex.: rows)."""
+        medida = {"name": nome, "rows": None}
+        self._amostrador.reset()
+        inicio = time.perf_counter()
+        try:
+            yield medida
+        finally:
+            medida["seconds"] = round(time.perf_counter() - inicio, 4)
+            medida["peak_rss_mb"] = _mb(self._amostrador.peak)
+            self.stages.append(medida)
+
+def _linhas_parquet(parquet_path):
+    try:
+        return pq.ParquetFile(parquet_path).metadata.num_rows
+    except Exception:
+        return None
+
+def record_report_metrics(profiler, session_folder, username, row_count, history_id=None):
+    """Guarda as métricas de um processamento (e o resumo do cProfile, compactado, se houver)."""
+    perfil = zlib.compress(profiler.profile_text.encode("utf-8")) if profiler.profile_text else None
+    with get_db().connection() as conn:
+        conn.execute("""
+            INSERT INTO report_metrics (history_id, recorded_at, user, session_folder, row_count, total_seconds,
+                                        peak_rss_mb, stages, profile)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (history_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), username, session_folder, row_count,
+              profiler.total_seconds, profiler.peak_rss_mb, json.dumps(profiler.stages), perfil))
+
+def get_report_metrics(limit=METRICS_TREND_RUNS):
+    """Métricas dos últimos processamentos, do mais antigo para o mais recente (para os gráficos de tendência)."""
+    with get_db().connection() as conn:
+        df = pd.read_sql_query("""
+            SELECT id, history_id, recorded_at, user, session_folder, row_count, total_seconds, peak_rss_mb, stages,
+                   profile IS NOT NULL AS has_profile
+            FROM report_metrics ORDER BY id DESC LIMIT ?
+        """, conn, params=(limit,))
+    df = df.iloc[::-1].reset_index(drop=True)
+    df["stages"] = df["stages"].map(lambda v: json.loads(v or "[]"))
+    df["has_profile"] = df["has_profile"].astype(bool)
+    return df
+
+def get_report_profile(metrics_id):
+    with get_db().connection() as conn:
+        linha = conn.execute("SELECT profile FROM report_metrics WHERE id = ?", (metrics_id,)).fetchone()
+    return zlib.decompress(linha[0]).decode("utf-8") if linha and linha[0] else None
+
+# ========================
+# Processamento em Segundo Plano
+# ========================
+REPORT_JOB_WORKERS = max(2, MAX_WORKERS // 2)
+REPORT_JOB_RETENTION_SECONDS = 3600
+REPORT_JOB_STEPS = ["Reading inputs"] + list(PIPELINE_STAGES.values()) + ["Writing report"]
+
+class JobCancelled(Exception):
+    pass
+
+class ReportJob:
+    """Estado de um processamento de relatório executado pelo ReportJobManager."""
+
+    def __init__(self, user, params):
+        self.id = uuid.uuid4().hex
+        self.user = user
+        self.params = params
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.step_name = None
+        self.step_index = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.future = None
+        self._cancelar = threading.Event()
+
+    @property
+    def progress(self):
+        return self.step_index / len(REPORT_JOB_STEPS)
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def step(self, nome):
+        """Registra o início de uma etapa; interrompe o job se o cancelamento foi pedido."""
+        if self._cancelar.is_set():
+            raise JobCancelled()
+        if self.step_name is not None:
+            self.step_index += 1
+        self.step_name = nome
+
+    def cancel(self):
+        self._cancelar.set()
+        if self.future is not None and self.future.cancel():
+            self.status = "cancelled"
+            self.finished_at = time.time()
+
+class ReportJobManager:
+    """Fila de processamentos compartilhada entre as sessões, executada por um pool de threads."""
+
+    def __init__(self, max_workers=REPORT_JOB_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, user, params):
+        self._prune()
+        job = ReportJob(user, params)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        self._prune()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def latest_for(self, user):
+        self._prune()
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.user == user]
+        return max(jobs, key=lambda job: job.created_at) if jobs else None
+
+    def _run(self, job):
+        job.status = "running"
+        try:
+            job.result = run_report_job(job, **job.params)
+            job.status = "done"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _prune(self):
+        limite = time.time() - REPORT_JOB_RETENTION_SECONDS
+        with self._lock:
+            for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished_at < limite]:
+                del self._jobs[job_id]
+
+def build_session_report(paths, session_folder, fuzzy_threshold=80, workers=1, low_memory=False, username=None,
+                         log_history=True, notify=True, progress=None, profile=False):
+    """Converte as entradas, roda o pipeline, grava o relatório da sessão e enfileira o e-mail.
+
+    paths segue a ordem de INPUT_FILE_NAMES. Usado pelos jobs da interface e pela execução em lote.
+    Tempo, linhas e memória de cada etapa (e o cProfile, com profile=True) vão para report_metrics.
+    """
+    progress = progress or (lambda nome: None)
+    team_path, train_path, control_path, training_type_path, unisea_path = paths
+    profiler = StageProfiler(profile=profile)
+    profiler.start()
+    try:
+        progress("Reading inputs")
+        with profiler.stage("Reading inputs") as medida:
+            ingeridos = [ensure_ingested(path, streaming=low_memory and path == control_path)
+                         for path in paths if path is not None]
+            medida["rows"] = sum(_linhas_parquet(parquet_path) or 0 for parquet_path in ingeridos)
+
+        df_final, reused_stages = run_pipeline(team_path, train_path, control_path, training_type_path, unisea_path,
+                                               fuzzy_threshold, workers, use_cache=True, low_memory=low_memory,
+                                               progress=progress, profiler=profiler)
+
+        progress("Writing report")
+        with profiler.stage("Writing report") as medida:
+            manifest = write_report_artifacts(df_final, session_folder)
+            record_session_report(session_folder, manifest, df_final, username)
+            medida["rows"] = len(df_final)
+        final_data_path = manifest["xlsx"]
+
+        if notify:
+            with profiler.stage("Queueing e-mail"):
+                email_subject = "Training Report Finalized"
+                email_body = "The report was processed successfully. Attached is the final file."
+                queue_email(email_subject, email_body, EMAIL_RECIPIENT, attachment_path=final_data_path)
+    finally:
+        profiler.stop()
+
+    history_id = None
+    if log_history:
+        history_id = log_report(report_type="Training Report", file_name=final_data_path, filter_options="", user=username)
+    record_report_metrics(profiler, session_folder, username, len(df_final), history_id)
+    return {"df_final": df_final, "reused_stages": reused_stages, "manifest": manifest, "metrics": profiler}
+
+def run_report_job(job, paths, fuzzy_threshold, workers, low_memory, session_folder, username, log_history,
+                   profile=False):
+    """Corpo do job: o relatório da sessão, com o andamento e o cancelamento controlados pelo job."""
+    return build_session_report(paths, session_folder, fuzzy_threshold, workers, low_memory, username, log_history,
+                                progress=job.step, profile=profile)
+
+# ========================
+# Exportação de Dados
+# ========================
+def dataset_version(df):
+    """Identificador do conteúdo de um DataFrame, usado como chave dos caches por versão dos dados."""
+    sha = hashlib.sha256("|".join(map(str, df.columns)).encode("utf-8"))
+    sha.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return sha.hexdigest()
+
+def write_xlsx_streaming(df, destino, sheet_name="Sheet1"):
+    """Grava um xlsx linha a linha com xlsxwriter em modo constant_memory.
+
+    O to_excel do pandas escreve coluna por coluna, o que não funciona com constant_memory;
+    aqui as linhas saem em ordem e cada uma é descartada da memória depois de gravada.
+    """
+    workbook = xlsxwriter.Workbook(destino, {"constant_memory": True,
+                                             "default_date_format": "yyyy-mm-dd hh:mm:ss"})
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(c) for c in df.columns], workbook.add_format({"bold": True}))
+    colunas = [df[col].astype(object).where(df[col].notna(), None) for col in df.columns]
+    for i, linha in enumerate(zip(*colunas), start=1):
+        worksheet.write_row(i, 0, linha)
+    workbook.close()
+
+def serialize_dataframe(df, fmt, sheet_name="Sheet1"):
+    """Bytes do DataFrame no formato pedido (xlsx, csv ou parquet)."""
+    buffer = io.BytesIO()
+    if fmt == "xlsx":
+        write_xlsx_streaming(df, buffer, sheet_name)
+    elif fmt == "csv":
+        df.to_csv(buffer, index=False, encoding="utf-8-sig")
+    elif fmt == "parquet":
+        write_parquet(df, buffer, mixed_as_text=True)
+    else:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    return buffer.getvalue()
+
+# ========================
+# Artefatos do Relatório Final
+# ========================
+REPORT_MANIFEST = "final.json"
+
+def read_file_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def write_report_artifacts(df_final, session_folder):
+    """Grava o relatório final uma única vez na pasta da sessão, endereçado pelo conteúdo.
+
+    O xlsx e o Parquet (zstd, mantém os dtypes compactos) recebem o nome final_<versão>, em que a
+    versão é o dataset_version dos dados: reprocessar os mesmos dados reaproveita os arquivos. O
+    manifesto final.json aponta para o relatório atual; download e anexo do e-mail usam esse xlsx.
+    Os arquivos do manifesto anterior são apagados depois da troca.
+    """
+    version = dataset_version(df_final)
+    xlsx_path = os.path.join(session_folder, f"final_{version[:16]}.xlsx")
+    parquet_path = parquet_path_for(xlsx_path)
+    # Temporários com nome único: dois jobs da mesma sessão podem gravar ao mesmo tempo
+    if not os.path.exists(xlsx_path):
+        with atomic_write(xlsx_path) as temporario:
+            write_xlsx_streaming(df_final, temporario)
+    if not os.path.exists(parquet_path):
+        with atomic_write(parquet_path) as temporario:
+            write_parquet(df_final, temporario, compression="zstd")
+
+    manifest = {
+        "version": version,
+        "xlsx": os.path.basename(xlsx_path),
+        "parquet": os.path.basename(parquet_path),
+        "sha256": file_sha256(xlsx_path),
+        "rows": len(df_final),
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    manifest_path = os.path.join(session_folder, REPORT_MANIFEST)
+    anterior = load_report_manifest(session_folder)
+    with atomic_write(manifest_path) as temporario, open(temporario, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    # O relatório anterior da sessão (de outros dados) não é mais referenciado pelo manifesto
+    if anterior is not None:
+        atuais = {os.path.abspath(xlsx_path), os.path.abspath(parquet_path)}
+        for campo in ("xlsx", "parquet"):
+            if anterior.get(campo) and os.path.abspath(anterior[campo]) not in atuais:
+                _remover_se_existir(anterior[campo])
+    return _resolver_manifest(manifest, session_folder)
+
+def _resolver_manifest(manifest, session_folder):
+    manifest = dict(manifest)
+    for campo in ("xlsx", "parquet"):
+        if manifest.get(campo):
+            manifest[campo] = os.path.join(session_folder, manifest[campo])
+    return manifest
+
+def load_report_manifest(session_folder):
+    """Manifesto do relatório da sessão (None se não houver relatório).
+
+    Sessões gravadas antes do manifesto têm só final.xlsx (e talvez final.parquet); para elas é
+    montado um manifesto equivalente, com caminho + mtime como versão.
+    """
+    manifest_path = os.path.join(session_folder, REPORT_MANIFEST)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            return _resolver_manifest(json.load(f), session_folder)
+    legado = os.path.join(session_folder, "final.xlsx")
+    if not os.path.exists(legado):
+        return None
+    parquet_legado = parquet_path_for(legado)
+    return {
+        "version": f"{legado}:{os.path.getmtime(legado)}",
+        "xlsx": legado,
+        "parquet": parquet_legado if os.path.exists(parquet_legado) else None,
+    }
+
+def read_report(manifest):
+    """Carrega o relatório de um manifesto, preferindo o Parquet."""
+    if manifest.get("parquet") and os.path.exists(manifest["parquet"]):
+        return read_parquet(manifest["parquet"])
+    return pd.read_excel(manifest["xlsx"])
+
+# ========================
+# Repositório de Uploads por Conteúdo
+# ========================
+BLOB_DIR = os.path.join(UPLOAD_DIR, ".blobs")
+SESSION_INPUTS = "inputs.json"
+BLOB_GC_GRACE_SECONDS = 3600
+
+def blob_path(sha):
+    return os.path.join(BLOB_DIR, sha[:2], f"{sha}.xlsx")
+
+def _gravar_blob(dados):
+    """Grava o conteúdo no repositório (se ainda não estiver lá) e retorna o seu SHA-256."""
+    sha = hashlib.sha256(dados).hexdigest()
+    destino = blob_path(sha)
+    if os.path.exists(destino):
+        # Renova o prazo de carência da coleta de lixo (os Parquets depois do xlsx, para não parecerem desatualizados)
+        os.utime(destino)
+        for parquet_path in (parquet_path_for(destino), stream_parquet_path_for(destino)):
+            if os.path.exists(parquet_path):
+                os.utime(parquet_path)
+    else:
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with atomic_write(destino) as temporario, open(temporario, "wb") as f:
+            f.write(dados)
+    return sha
+
+def is_blob(path):
+    return os.path.dirname(os.path.dirname(os.path.abspath(path))) == os.path.abspath(BLOB_DIR)
+
+def content_hash(path):
+    """SHA-256 do arquivo; para um blob é o próprio nome, sem reler o conteúdo."""
+    if path is None:
+        return None
+    if is_blob(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    return file_sha256(path)
+
+def read_session_inputs(folder):
+    """Arquivos de entrada da sessão ({nome: caminho}).
+
+    Sessões com inputs.json referenciam blobs; as anteriores ao repositório guardam as
+    planilhas na própria pasta.
+    """
+    manifesto = os.path.join(folder, SESSION_INPUTS)
+    if os.path.exists(manifesto):
+        with open(manifesto, encoding="utf-8") as f:
+            return {nome: blob_path(sha) for nome, sha in json.load(f).items()}
+    return {nome: os.path.join(folder, nome) for nome in INPUT_FILE_NAMES
+            if os.path.exists(os.path.join(folder, nome))}
+
+def save_session_inputs(folder, uploads):
+    """Guarda os arquivos enviados ({nome: arquivo ou None}) no repositório e atualiza inputs.json.
+
+    Nomes sem arquivo mantêm a referência anterior da sessão (planilhas antigas, gravadas na
+    pasta, são importadas para o repositório). Retorna {nome: caminho do blob}.
+    """
+    hashes = {}
+    for nome, caminho in read_session_inputs(folder).items():
+        if is_blob(caminho):
+            hashes[nome] = content_hash(caminho)
+        else:
+            hashes[nome] = _gravar_blob(read_file_bytes(caminho))
+    for nome, arquivo in uploads.items():
+        if arquivo is not None:
+            hashes[nome] = _gravar_blob(arquivo.getbuffer())
+
+    manifesto = os.path.join(folder, SESSION_INPUTS)
+    with atomic_write(manifesto) as temporario, open(temporario, "w", encoding="utf-8") as f:
+        json.dump(hashes, f, indent=2)
+    return {nome: blob_path(sha) for nome, sha in hashes.items()}
+
+def collect_garbage_blobs(grace_seconds=BLOB_GC_GRACE_SECONDS):
+    """Apaga os blobs (e seus Parquet) que nenhuma sessão do catálogo referencia.
+
+    Sessões cuja pasta foi apagada saem do catálogo antes da coleta. Arquivos mais novos que
+    grace_seconds são mantidos, pois podem ser de um upload ainda não registrado.
+    Retorna (arquivos removidos, bytes liberados).
+    """
+    referenciados = set()
+    with get_db().connection() as conn:
+        for folder, file_hashes in conn.execute("SELECT folder, file_hashes FROM upload_sessions").fetchall():
+            if os.path.isdir(folder):
+                referenciados.update(json.loads(file_hashes or "{}").values())
+            else:
+                conn.execute("DELETE FROM upload_sessions WHERE folder = ?", (folder,))
+    if not os.path.isdir(BLOB_DIR):
+        return 0, 0
+
+    limite = time.time() - grace_seconds
+    removidos, liberados = 0, 0
+    for raiz, _, arquivos in os.walk(BLOB_DIR):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            sha = nome.split(".")[0]
+            info = os.stat(caminho)
+            if sha in referenciados or info.st_mtime > limite:
+                continue
+            os.remove(caminho)
+            removidos += 1
+            liberados += info.st_size
+    return removidos, liberados
+
+# ========================
+# Catálogo de Sessões de Upload
+# ========================
+SESSION_PREVIEW_ROWS = 100
+INPUT_FILE_NAMES = ["Team.xlsx", "Trainings.xlsx", "Control.xlsx", "Training_Type_Listing.xlsx", "Unisea_Sheet.xlsx"]
+
+def _data_da_pasta(folder):
+    """Data da sessão a partir do nome da pasta (YYYYmmddHHMMSS); None se o nome não seguir o padrão."""
+    try:
+        return datetime.strptime(os.path.basename(folder), "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+def _hashes_entradas(folder):
+    return {nome: content_hash(caminho) for nome, caminho in read_session_inputs(folder).items()}
+
+def _resumo_status(status):
+    return {str(k): int(v) for k, v in status.value_counts().items()}
+
+def register_upload_session(folder, username, conn=None):
+    """Registra uma sessão recém-gravada (ou atualiza os hashes das entradas de uma já catalogada)."""
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    registro = (folder, _data_da_pasta(folder) or agora, username, json.dumps(_hashes_entradas(folder)), agora)
+    sql = """
+        INSERT INTO upload_sessions (folder, created_at, username, status, file_hashes, updated_at)
+        VALUES (?, ?, ?, 'uploaded', ?, ?)
+        ON CONFLICT(folder) DO UPDATE SET file_hashes = excluded.file_hashes, updated_at = excluded.updated_at
+    """
+    if conn is not None:
+        conn.execute(sql, registro)
+    else:
+        with get_db().connection() as conn:
+            conn.execute(sql, registro)
+
+def record_session_report(folder, manifest, df_final, username=None, conn=None):
+    """Guarda no catálogo o resultado do processamento: linhas, resumo de status e artefatos."""
+    resumo = _resumo_status(df_final["status_final"]) if "status_final" in df_final.columns else {}
+    agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def gravar(conn):
+        register_upload_session(folder, username, conn)
+        conn.execute("""
+            UPDATE upload_sessions
+            SET status = 'processed', row_count = ?, status_summary = ?, report_version = ?,
+                report_xlsx = ?, report_parquet = ?, updated_at = ?
+            WHERE folder = ?
+        """, (len(df_final), json.dumps(resumo), manifest["version"], manifest["xlsx"], manifest.get("parquet"),
+              agora, folder))
+
+    if conn is not None:
+        gravar(conn)
+    else:
+        with get_db().connection() as conn:
+            gravar(conn)
+
+def _sessao_do_registro(row):
+    sessao = dict(row)
+    sessao["file_hashes"] = json.loads(sessao["file_hashes"] or "{}")
+    sessao["status_summary"] = json.loads(sessao["status_summary"] or "{}")
+    return sessao
+
+def get_upload_sessions(with_report=False, limit=None):
+    """Sessões do catálogo, da mais recente para a mais antiga (lidas pelo índice de created_at)."""
+    sql = "SELECT * FROM upload_sessions"
+    if with_report:
+        sql += " WHERE status = 'processed'"
+    sql += " ORDER BY created_at DESC, folder DESC"
+    params = ()
+    if limit is not None:
+        sql += " LIMIT ?"
+        params = (limit,)
+    with get_db().connection() as conn:
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.row_factory = None
+    return [_sessao_do_registro(row) for row in rows]
+
+def get_last_upload_session():
+    sessoes = get_upload_sessions(limit=1)
+    return sessoes[0] if sessoes else None
+
+def session_report_manifest(sessao):
+    return {"version": sessao["report_version"], "xlsx": sessao["report_xlsx"], "parquet": sessao["report_parquet"]}
+
+def read_report_preview(manifest, n_rows=SESSION_PREVIEW_ROWS):
+    """Primeiras n_rows linhas do relatório, sem carregar o arquivo inteiro."""
+    if manifest.get("parquet") and os.path.exists(manifest["parquet"]):
+        arquivo = pq.ParquetFile(manifest["parquet"])
+        lote = next(arquivo.iter_batches(batch_size=n_rows), None)
+        if lote is None:
+            return table_to_pandas(arquivo.schema_arrow.empty_table())
+        return table_to_pandas(pa.Table.from_batches([lote], schema=arquivo.schema_arrow))
+    return pd.read_excel(manifest["xlsx"], nrows=n_rows)
+
+def sync_upload_catalog():
+    """Cataloga, uma vez por processo, as pastas de uploaded_files que ainda não estão no catálogo.
+
+    Cobre as sessões gravadas antes do catálogo existir; as novas são registradas no upload.
+    """
+    if not os.path.isdir(UPLOAD_DIR):
+        return 0
+    with get_db().connection() as conn:
+        catalogadas = {r[0] for r in conn.execute("SELECT folder FROM upload_sessions")}
+    novas = 0
+    for nome in sorted(os.listdir(UPLOAD_DIR)):
+        folder = os.path.join(UPLOAD_DIR, nome)
+        if nome.startswith(".") or folder in catalogadas or not os.path.isdir(folder):
+            continue
+        manifest = load_report_manifest(folder)
+        with get_db().connection() as conn:
+            if manifest is None:
+                register_upload_session(folder, None, conn)
+            else:
+                record_session_report(folder, manifest, read_report(manifest), conn=conn)
+        novas += 1
+    return novas
+
+# ========================
+# Execução em Lote (linha de comando)
+# ========================
+def _e_sessao(folder):
+    return os.path.isdir(folder) and (os.path.exists(os.path.join(folder, SESSION_INPUTS))
+                                      or os.path.exists(os.path.join(folder, INPUT_FILE_NAMES[0])))
+
+def find_session_folders(path, latest=False):
+    """Sessões em path: a própria pasta, se for uma sessão, ou as sessões dentro dela (em ordem de data).
+
+    Com latest=True, só a mais recente de cada diretório (ex.: uma pasta por embarcação).
+    """
+    if _e_sessao(path):
+        return [path]
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Session folder or directory not found: {path}")
+    pastas = sorted(os.path.join(path, nome) for nome in os.listdir(path)
+                    if not nome.startswith(".") and _e_sessao(os.path.join(path, nome)))
+    return pastas[-1:] if latest else pastas
+
+def process_session_folder(folder, fuzzy_threshold=80, workers=1, low_memory=False, username="batch", notify=True,
+                           profile=False):
+    """Processa uma sessão gravada em disco; retorna (linhas, etapas reaproveitadas, xlsx do relatório)."""
+    entradas = read_session_inputs(folder)
+    faltando = [nome for nome in INPUT_FILE_NAMES[:3] if nome not in entradas]
+    if faltando:
+        raise FileNotFoundError(f"missing {', '.join(faltando)}")
+    register_upload_session(folder, username)
+    resultado = build_session_report(tuple(entradas.get(nome) for nome in INPUT_FILE_NAMES), folder, fuzzy_threshold,
+                                     workers, low_memory, username, log_history=True, notify=notify, profile=profile)
+    return len(resultado["df_final"]), resultado["reused_stages"], resultado["manifest"]["xlsx"]
+
+def _processar_na_fila(folder, opcoes):
+    inicio = time.perf_counter()
+    try:
+        linhas, reaproveitadas, xlsx = process_session_folder(folder, **opcoes)
+    except Exception as e:
+        return folder, False, f"{type(e).__name__}: {e}", time.perf_counter() - inicio
+    detalhe = f"{linhas} rows, report {xlsx}"
+    if reaproveitadas:
+        detalhe += f", reused: {', '.join(reaproveitadas)}"
+    return folder, True, detalhe, time.perf_counter() - inicio
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Process Training Report sessions (uploaded_files/<timestamp>) without the web interface.")
+    parser.add_argument("paths", nargs="*",
+                        help="session folders, or directories of sessions (e.g. uploaded_files, one per vessel), "
+                             "relative to --root")
+    parser.add_argument("--root", default=".", help="application folder (database, uploaded_files); default: current")
+    parser.add_argument("--latest", action="store_true", help="only the most recent session of each directory")
+    parser.add_argument("--skip-processed", action="store_true", help="skip sessions that already have a final report")
+    parser.add_argument("--parallel", type=int, default=1, help="sessions processed at the same time (processes)")
+    parser.add_argument("--fuzzy-threshold", type=int, default=80)
+    parser.add_argument("--match-workers", type=int, default=None,
+                        help="threads of the control matching per session; default: CPUs / --parallel")
+    parser.add_argument("--low-memory", action="store_true", help="stream Control.xlsx in batches")
+    parser.add_argument("--user", default="batch", help="user recorded in the history and catalog")
+    parser.add_argument("--profile", action="store_true",
+                        help="capture a cProfile summary of each session (shown in the admin Performance panel)")
+    parser.add_argument("--no-email", action="store_true", help="do not queue the report e-mails")
+    parser.add_argument("--archive-history", type=int, metavar="DAYS", default=None,
+                        help="after processing, move report history entries older than DAYS into the "
+                             f"compressed archive (e.g. {HISTORY_RETENTION_DAYS}); can run without paths")
+    args = parser.parse_args(argv)
+    if not args.paths and args.archive_history is None:
+        parser.error("give at least one session path or --archive-history")
+    if args.archive_history is not None and args.archive_history < 1:
+        parser.error("--archive-history must be at least 1 day")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    os.chdir(args.root)
+
+    pastas, falhas = [], 0
+    for path in args.paths:
+        try:
+            encontradas = find_session_folders(path, latest=args.latest)
+        except FileNotFoundError as e:
+            print(f"FAILED {path}: {e}", flush=True)
+            falhas += 1
+            continue
+        for folder in encontradas:
+            if args.skip_processed and load_report_manifest(folder) is not None:
+                logger.info("Skipping %s (already processed)", folder)
+            elif folder not in pastas:
+                pastas.append(folder)
+
+    paralelo = max(1, min(args.parallel, len(pastas) or 1))
+    opcoes = {
+        "fuzzy_threshold": args.fuzzy_threshold,
+        "workers": args.match_workers or max(1, MAX_WORKERS // paralelo),
+        "low_memory": args.low_memory,
+        "username": args.user,
+        "notify": not args.no_email,
+        "profile": args.profile,
+    }
+    if paralelo == 1:
+        resultados = (_processar_na_fila(folder, opcoes) for folder in pastas)
+    else:
+        # Processos separados: cada um abre o próprio pool de conexões (get_db ainda não foi chamado aqui)
+        executor = ProcessPoolExecutor(max_workers=paralelo)
+        resultados = executor.map(_processar_na_fila, pastas, [opcoes] * len(pastas))
+
+    processadas = 0
+    for folder, ok, detalhe, segundos in resultados:
+        print(f"{'OK' if ok else 'FAILED':6} {folder} ({segundos:.1f}s): {detalhe}", flush=True)
+        processadas += ok
+        falhas += not ok
+    if paralelo > 1:
+        executor.shutdown()
+
+    if pastas and not args.no_email:
+        # Sem o worker da interface, os e-mails enfileirados são enviados antes de sair
+        worker = EmailWorker(get_db())
+        while worker.drain():
+            pass
+        worker.smtp.close()
+    if args.paths:
+        print(f"{processadas}/{len(pastas)} session(s) processed", flush=True)
+
+    if args.archive_history is not None:
+        # Job de retenção: roda depois das sessões para não disputar o banco com elas
+        try:
+            movidas = archive_report_history(args.archive_history)
+        except sqlite3.Error as e:
+            print(f"FAILED history archive: {e}", flush=True)
+            falhas += 1
+        else:
+            print(f"{movidas} history entr{'y' if movidas == 1 else 'ies'} older than "
+                  f"{args.archive_history} day(s) archived", flush=True)
+    return 1 if falhas else 0
+
+if __name__ == "__main__":
+    sys.exit(main())